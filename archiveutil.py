@@ -0,0 +1,153 @@
+"""
+per-station monthly archives of ascents
+
+next to the individual detail files of a month,
+
+    {source}/{cc}/{subdir}/{year}/{month}/{station_id}_{year}{month}.month.bin
+
+holds all ascents of the station in that month as a sequence of records:
+
+    header      magic "RSAM", u8 version, 3 bytes 0
+    record      i64 syn_timestamp, u32 length, then length bytes of
+                binaryutil.encode(fc, config.ARCHIVE_CODEC)
+
+process.py --archive appends a record per ascent it writes, so a month
+in progress may hold an ascent more than once, or out of order. Readers
+keep the last record per syn_timestamp. A record of length 0 marks the
+ascent as superseded - process.py --merge replaced it by a report in
+another tree - and readers drop it. compact.py rebuilds finished months
+from the detail files, sorted by time and without duplicates.
+
+reading a station-year this way opens twelve files instead of hundreds.
+"""
+
+import logging
+import os
+import struct
+from datetime import datetime
+
+import binaryutil
+
+import config
+
+MAGIC = b"RSAM"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sB3x")
+_RECORD = struct.Struct("<qI")
+
+
+def archive_path(destdir, reldir, station_id):
+    """
+    the archive of a station in the month directory reldir
+    ("{source}/{cc}/{subdir}/{year}/{month}", see geojsonutil.detail_path)
+    """
+    year, month = reldir.rsplit("/", 2)[1:]
+    return f"{destdir}/{reldir}/{station_id}_{year}{month}{config.ARCHIVE_SUFFIX}"
+
+
+def record(fc, codec=config.ARCHIVE_CODEC):
+    b = binaryutil.encode(fc, codec)
+    return _RECORD.pack(fc.properties["syn_timestamp"], len(b)) + b
+
+
+def append(path, fc):
+    """
+    append an ascent to the archive at path, creating it if needed.
+    A single write in append mode, so concurrent appenders do not
+    interleave records.
+    """
+    b = record(fc)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        if os.fstat(fd).st_size == 0:
+            b = _HEADER.pack(MAGIC, VERSION) + b
+        os.write(fd, b)
+    finally:
+        os.close(fd)
+
+
+def supersede(path, syn_timestamp):
+    """
+    mark the ascent at syn_timestamp in the archive at path as replaced
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    try:
+        os.write(fd, _RECORD.pack(syn_timestamp, 0))
+    finally:
+        os.close(fd)
+
+
+def records(b, start=None, end=None):
+    """
+    yield (syn_timestamp, blob) of the records in an archive,
+    with start <= syn_timestamp < end if given
+    """
+    magic, version = _HEADER.unpack_from(b, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a version {VERSION} archive")
+    pos = _HEADER.size
+    while pos + _RECORD.size <= len(b):
+        ts, n = _RECORD.unpack_from(b, pos)
+        pos += _RECORD.size
+        if pos + n > len(b):
+            logging.warning(f"truncated archive record at {pos}")
+            break
+        if (start is None or ts >= start) and (end is None or ts < end):
+            yield ts, b[pos : pos + n]
+        pos += n
+
+
+def read_archive(path, start=None, end=None):
+    """
+    return [(properties, {column: [float, ...]}), ...] of the ascents
+    in an archive, oldest first, last record per syn_timestamp
+    unless that one marks it superseded
+    """
+    with open(path, "rb") as f:
+        b = f.read()
+    latest = {}
+    for ts, blob in records(b, start, end):
+        latest[ts] = blob
+    return [binaryutil.decode(latest[ts]) for ts in sorted(latest) if latest[ts]]
+
+
+def build_archive(fcs):
+    """
+    the contents of a sealed archive of a list of ascents: sorted,
+    one per syn_timestamp, the last one given winning
+    """
+    latest = {}
+    for fc in fcs:
+        latest[fc.properties["syn_timestamp"]] = fc
+    return _HEADER.pack(MAGIC, VERSION) + b"".join(
+        record(latest[ts]) for ts in sorted(latest)
+    )
+
+
+def months(start, end):
+    """
+    the (year, month) tuples covering start <= t < end
+    """
+    t = datetime.utcfromtimestamp(start)
+    y, m = t.year, t.month
+    last = datetime.utcfromtimestamp(end - 1)
+    while (y, m) <= (last.year, last.month):
+        yield y, m
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def query(destdir, source, station_id, start, end):
+    """
+    all ascents of a station with start <= syn_timestamp < end from
+    the monthly archives below destdir, oldest first
+    """
+    cc = station_id[:2]
+    subdir = station_id[2:5]
+    result = []
+    for y, m in months(start, end):
+        reldir = f"{source}/{cc}/{subdir}/{y:04d}/{m:02d}"
+        path = archive_path(destdir, reldir, station_id)
+        if os.path.exists(path):
+            result.extend(read_archive(path, start, end))
+    return result
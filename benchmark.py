@@ -0,0 +1,710 @@
+"""
+benchmark the decode -> convert -> write pipeline on synthetic data
+
+generate BUFR TEMP messages at various level counts and MADIS-like
+netCDF files at various station counts, time each stage separately,
+report throughput and peak memory, and compare against a JSON baseline.
+
+example:
+    python benchmark.py --save-baseline bench-baseline.json
+    python benchmark.py --baseline bench-baseline.json --tolerance 0.2
+"""
+
+import argparse
+import copy
+import gzip
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import brotli
+
+from eccodes import (
+    codes_bufr_new_from_samples,
+    codes_get_message,
+    codes_release,
+    codes_set,
+    codes_set_array,
+)
+
+import geojson
+
+from netCDF4 import Dataset
+
+import numpy as np
+
+import pytz
+
+from bufrutil import bufr_decode, bufr_qc, convert_bufr_to_geojson
+
+import config
+
+from geojsonutil import write_geojson
+
+from netcdfutil import RemNaN_and_Interp, emit_ascents, read_netcdf
+
+from process import update_geojson_summary
+
+import summaryutil
+
+import thermodynamics
+
+import thermoutil
+
+import util
+
+# MADIS mandatory levels, hPa
+MANDATORY_LEVELS = [
+    1000.0,
+    925.0,
+    850.0,
+    700.0,
+    500.0,
+    400.0,
+    300.0,
+    250.0,
+    200.0,
+    150.0,
+    100.0,
+    70.0,
+    50.0,
+    30.0,
+    20.0,
+    10.0,
+]
+
+SYN_TIME = datetime(2021, 2, 6, 12, 0, 0, tzinfo=pytz.utc)
+
+# the MetPy comparison of bench_thermo, run as python -c METPY_STAGE
+# profiles.npz repeat. Prints the list of durations as JSON.
+METPY_STAGE = """
+import json, sys, time
+import numpy as np
+try:
+    from metpy import calc as mpcalc
+    from metpy.units import units
+except ImportError:
+    sys.exit(2)
+with np.load(sys.argv[1]) as npz:
+    columns = [npz[f"arr_{i}"] for i in range(len(npz.files))]
+times = []
+for _ in range(int(sys.argv[2])):
+    start = time.perf_counter()
+    for i in range(0, len(columns), 3):
+        t = columns[i] * units.kelvin
+        td = columns[i + 1] * units.kelvin
+        p = columns[i + 2] * units.hPa
+        mpcalc.potential_temperature(p, t)
+        mpcalc.equivalent_potential_temperature(p, t, td)
+        mpcalc.mixing_ratio_from_relative_humidity(
+            p, t, mpcalc.relative_humidity_from_dewpoint(t, td)
+        )
+        mpcalc.wet_bulb_temperature(p, t, td)
+    times.append(time.perf_counter() - start)
+print(json.dumps(times))
+"""
+
+
+def standard_atmosphere(height):
+    """temperature (K) and pressure (Pa) of the ICAO standard atmosphere"""
+    height = np.asarray(height, dtype=float)
+    temp = np.where(height < 11000, 288.15 - 0.0065 * height, 216.65)
+    pres = np.where(
+        height < 11000,
+        101325.0 * (1 - 2.25577e-5 * height) ** 5.25588,
+        22632.1 * np.exp(-1.5769e-4 * (height - 11000)),
+    )
+    return temp, pres
+
+
+def synthetic_profile(rng, levels, elevation, top=30000.0):
+    """a smooth, slightly noisy ascent from elevation to top with levels samples"""
+    height = np.linspace(elevation, top, levels)
+    temp, pres = standard_atmosphere(height)
+    temp = temp + rng.normal(0, 0.3, levels)
+    dewpoint = temp - rng.uniform(1.0, 15.0, levels)
+    wspeed = 5.0 + height / 1000.0 + rng.normal(0, 0.5, levels).clip(-4, 4)
+    wdir = (250.0 + rng.normal(0, 10, levels)) % 360
+    return height, temp, dewpoint, pres, wspeed, wdir
+
+
+def synthetic_stations(n):
+    stations = {}
+    for i in range(n):
+        sid = f"{10 + i // 1000:02d}{i % 1000:03d}"
+        stations[sid] = {
+            "name": f"Synthetic {sid}",
+            "lat": round(-60.0 + (i * 7.31) % 120.0, 4),
+            "lon": round(-180.0 + (i * 13.7) % 360.0, 4),
+            "elevation": float(50 + (i * 37) % 1500),
+        }
+    return stations
+
+
+def synthetic_bufr(rng, levels, station_id, station, syn_time=SYN_TIME):
+    """encode a single-subset FM94 TEMP (309052) message"""
+    height, temp, dewpoint, pres, wspeed, wdir = synthetic_profile(
+        rng, levels, station["elevation"]
+    )
+    secs = (height - height[0]) / config.ASCENT_RATE
+    dlat = np.cumsum(rng.normal(0.0002, 0.0001, levels))
+    dlon = np.cumsum(rng.normal(0.0004, 0.0001, levels))
+    takeoff = syn_time.timestamp() - 3600
+
+    b = codes_bufr_new_from_samples("BUFR4")
+    codes_set(b, "masterTablesVersionNumber", 13)
+    codes_set(b, "dataCategory", 2)
+    codes_set(b, "internationalDataSubCategory", 4)
+    codes_set(b, "typicalYear", syn_time.year)
+    codes_set(b, "typicalMonth", syn_time.month)
+    codes_set(b, "typicalDay", syn_time.day)
+    codes_set(b, "typicalHour", syn_time.hour)
+    codes_set(b, "typicalMinute", syn_time.minute)
+    codes_set(b, "typicalSecond", syn_time.second)
+    codes_set(b, "numberOfSubsets", 1)
+    codes_set(b, "compressedData", 0)
+    codes_set_array(b, "inputExtendedDelayedDescriptorReplicationFactor", [levels, 0])
+    codes_set(b, "unexpandedDescriptors", 309052)
+
+    t0 = datetime.utcfromtimestamp(takeoff)
+    codes_set(b, "blockNumber", int(station_id[:2]))
+    codes_set(b, "stationNumber", int(station_id[2:5]))
+    codes_set(b, "radiosondeType", 141)
+    codes_set(b, "year", t0.year)
+    codes_set(b, "month", t0.month)
+    codes_set(b, "day", t0.day)
+    codes_set(b, "hour", t0.hour)
+    codes_set(b, "minute", t0.minute)
+    codes_set(b, "second", t0.second)
+    codes_set(b, "latitude", station["lat"])
+    codes_set(b, "longitude", station["lon"])
+    codes_set(b, "height", int(station["elevation"]))
+
+    for i in range(levels):
+        n = i + 1
+        codes_set(b, f"#{n}#timePeriod", int(secs[i]))
+        codes_set(b, f"#{n}#pressure", float(round(pres[i], -1)))
+        codes_set(b, f"#{n}#nonCoordinateGeopotentialHeight", int(height[i]))
+        codes_set(b, f"#{n}#latitudeDisplacement", float(dlat[i]))
+        codes_set(b, f"#{n}#longitudeDisplacement", float(dlon[i]))
+        codes_set(b, f"#{n}#airTemperature", float(temp[i]))
+        codes_set(b, f"#{n}#dewpointTemperature", float(dewpoint[i]))
+        codes_set(b, f"#{n}#windDirection", int(wdir[i]))
+        codes_set(b, f"#{n}#windSpeed", float(wspeed[i]))
+    codes_set(b, "pack", 1)
+    msg = codes_get_message(b)
+    codes_release(b)
+    return msg
+
+
+def synthetic_madis(rng, stations, levels, tmpdir, syn_time=SYN_TIME):
+    """
+    write a MADIS RAOB-like netCDF file for the given stations with
+    levels significant temperature levels, return it gzipped
+    """
+    n = len(stations)
+    fd, path = tempfile.mkstemp(suffix=".nc", dir=tmpdir)
+    os.close(fd)
+    nc = Dataset(path, "w")
+    nc.createDimension("recNum", n)
+    nc.createDimension("manLevel", len(MANDATORY_LEVELS))
+    nc.createDimension("sigTLevel", levels)
+
+    def var(name, dtype, dims):
+        return nc.createVariable(name, dtype, dims, fill_value=99999.0)
+
+    ivar = {}
+    for name in ["relTime", "synTime", "wmoStaNum", "sondTyp"]:
+        ivar[name] = nc.createVariable(name, "i4", ("recNum",))
+    fvar = {}
+    for name in ["staLat", "staLon", "staElev"]:
+        fvar[name] = var(name, "f4", ("recNum",))
+    for name in ["prMan", "tpMan", "tdMan", "wsMan", "wdMan"]:
+        fvar[name] = var(name, "f4", ("recNum", "manLevel"))
+    for name in ["prSigT", "tpSigT", "tdSigT"]:
+        fvar[name] = var(name, "f4", ("recNum", "sigTLevel"))
+
+    for r, (sid, st) in enumerate(stations.items()):
+        ivar["relTime"][r] = int(syn_time.timestamp()) - 3600
+        ivar["synTime"][r] = int(syn_time.timestamp())
+        ivar["wmoStaNum"][r] = int(sid)
+        ivar["sondTyp"][r] = 52
+        fvar["staLat"][r] = st["lat"]
+        fvar["staLon"][r] = st["lon"]
+        fvar["staElev"][r] = st["elevation"]
+
+        height, temp, dewpoint, pres, wspeed, wdir = synthetic_profile(
+            rng, levels, st["elevation"], top=26000.0
+        )
+        fvar["prSigT"][r, :] = pres / 100.0
+        fvar["tpSigT"][r, :] = temp
+        fvar["tdSigT"][r, :] = temp - dewpoint
+
+        pm = np.array(MANDATORY_LEVELS) * 100.0
+        order = np.argsort(pres)
+        fvar["prMan"][r, :] = pm / 100.0
+        fvar["tpMan"][r, :] = np.interp(pm, pres[order], temp[order])
+        fvar["tdMan"][r, :] = np.interp(pm, pres[order], (temp - dewpoint)[order])
+        fvar["wsMan"][r, :] = np.interp(pm, pres[order], wspeed[order])
+        fvar["wdMan"][r, :] = np.interp(pm, pres[order], wdir[order])
+    nc.close()
+
+    with open(path, "rb") as f:
+        data = gzip.compress(f.read())
+    os.remove(path)
+    return data
+
+
+def measure(fn, setup, repeat, memory):
+    """
+    run fn(*setup()) repeat times, timing only fn.
+    returns the last result, a list of durations and the
+    peak traced memory of an extra run (or None).
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        inputs = setup()
+        start = time.perf_counter()
+        result = fn(*inputs)
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        inputs = setup()
+        tracemalloc.start()
+        fn(*inputs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, times, peak
+
+
+def record(results, key, times, peak, ascents, levels):
+    best = min(times)
+    results[key] = {
+        "best": best,
+        "median": statistics.median(times),
+        "ascents": ascents,
+        "levels": levels,
+        "ascents_per_s": ascents / best if best else None,
+        "levels_per_s": levels / best if best else None,
+        "peak_bytes": peak,
+    }
+    peak_mb = f"{peak / 1e6:9.1f}" if peak is not None else " " * 9
+    print(
+        f"{key:48s} {best * 1000:10.2f}ms {ascents / best:10.1f} asc/s"
+        f" {levels / best:12.0f} lvl/s {peak_mb} MB"
+    )
+
+
+def bench_write(args, prefix, source, fcs, stations, results, workdir):
+    """the stages from GeoJSON FeatureCollections to the summary"""
+    nlevels = sum(len(fc.features) for fc in fcs)
+    nasc = len(fcs)
+    wargs = argparse.Namespace(
+        station=None,
+        destdir=os.path.join(workdir, "data"),
+        dump_geojson=False,
+        binary=None,
+        chunked=False,
+        archive=False,
+        merge=False,
+        preview=False,
+        summary=os.path.join(workdir, "summary.geojson.br"),
+        compact_codec="json",
+        max_age=config.MAX_DAYS_IN_SUMMARY,
+    )
+
+    def write_all(fcs):
+        updated = []
+        for fc in fcs:
+            write_geojson(wargs, source, fc, "synthetic", None, updated)
+        return updated
+
+    updated, times, peak = measure(
+        write_all, lambda: (fcs,), args.repeat, args.memory
+    )
+    record(results, f"{prefix}/write_geojson", times, peak, nasc, nlevels)
+
+    def serialize(fcs):
+        return [
+            geojson.dumps(fc, indent=config.INDENT).encode(config.CHARSET)
+            for fc in fcs
+        ]
+
+    blobs, times, peak = measure(serialize, lambda: (fcs,), args.repeat, args.memory)
+    record(results, f"{prefix}/serialize", times, peak, nasc, nlevels)
+
+    def compress(blobs):
+        return [
+            brotli.compress(b, quality=config.BROTLI_SUMMARY_QUALITY) for b in blobs
+        ]
+
+    _, times, peak = measure(compress, lambda: (blobs,), args.repeat, args.memory)
+    record(results, f"{prefix}/compress", times, peak, nasc, nlevels)
+
+    _, times, peak = measure(
+        lambda u, s: update_geojson_summary(wargs, stations, u, s),
+        lambda: (copy.deepcopy(updated), geojson.FeatureCollection([])),
+        args.repeat,
+        args.memory,
+    )
+    record(results, f"{prefix}/update_geojson_summary", times, peak, nasc, nlevels)
+    check_compact(wargs.summary)
+
+
+def check_compact(path):
+    """
+    decode the compact summary with each codec and compare every
+    station and ascent field with the summary it was made from
+    """
+    summary = util.read_json_file(path, useBrotli=path.endswith(".br"))
+    c = summaryutil.compact_summary(geojson.loads(json.dumps(summary)))
+    decoded = {
+        "json": json.loads(json.dumps(c)),
+        "delta": summaryutil.unpack_compact(summaryutil.pack_compact(c)),
+    }
+    for codec, d in decoded.items():
+        expanded = summaryutil.expand_compact(d)
+        for f, g in zip(summary["features"], expanded["features"], strict=True):
+            for k, v in f["properties"].items():
+                if k == "ascents":
+                    continue
+                if g["properties"][k] != v:
+                    raise ValueError(f"compact {codec}: station {k} {v!r}")
+            for a, b in zip(
+                f["properties"]["ascents"], g["properties"]["ascents"], strict=True
+            ):
+                for k, v in a.items():
+                    if k not in b or b[k] != v or type(b[k]) is not type(v):
+                        raise ValueError(
+                            f"compact {codec}: ascent {k} {v!r} -> {b.get(k)!r}"
+                        )
+                if b.keys() - a.keys():
+                    raise ValueError(f"compact {codec}: extra {b.keys() - a.keys()}")
+        logging.debug(f"compact {codec}: round trip of {path} ok")
+
+
+def bench_bufr(args, rng, levels, results, workdir):
+    prefix = f"bufr/levels={levels}"
+    stations = synthetic_stations(args.messages)
+    files = []
+    for sid, st in stations.items():
+        path = os.path.join(workdir, f"{sid}.bufr")
+        with open(path, "wb") as f:
+            f.write(synthetic_bufr(rng, levels, sid, st))
+        files.append(path)
+
+    cargs = argparse.Namespace(hstep=args.hstep, thinning=args.thinning, station=None)
+
+    def decode_all(files):
+        decoded = []
+        for fn in files:
+            with open(fn, "rb") as f:
+                decoded.append(bufr_decode(f, fn, None, cargs))
+        return decoded
+
+    decoded, times, peak = measure(
+        decode_all, lambda: (files,), args.repeat, args.memory
+    )
+    nasc = len(files)
+    record(results, f"{prefix}/bufr_decode", times, peak, nasc, nasc * levels)
+
+    headers = []
+    for (h, s), fn in zip(decoded, files):
+        if bufr_qc(cargs, h, s, fn, None):
+            h["samples"] = s
+            headers.append(h)
+
+    def convert_all(headers):
+        return [convert_bufr_to_geojson(cargs, h) for h in headers]
+
+    fcs, times, peak = measure(
+        convert_all, lambda: (headers,), args.repeat, args.memory
+    )
+    record(
+        results,
+        f"{prefix}/convert_bufr_to_geojson",
+        times,
+        peak,
+        len(headers),
+        len(headers) * levels,
+    )
+    bench_write(args, prefix, "gisc", fcs, stations, results, workdir)
+
+
+def bench_madis(args, rng, nstations, results, workdir):
+    prefix = f"madis/stations={nstations}"
+    stations = synthetic_stations(nstations)
+    path = os.path.join(workdir, "synthetic.gz")
+    with open(path, "wb") as f:
+        f.write(synthetic_madis(rng, stations, args.madis_levels, workdir))
+    nlevels = nstations * args.madis_levels
+
+    raob, times, peak = measure(read_netcdf, lambda: (path,), args.repeat, args.memory)
+    record(results, f"{prefix}/read_netcdf", times, peak, nstations, nlevels)
+
+    profiles, times, peak = measure(
+        RemNaN_and_Interp, lambda: (raob, path), args.repeat, args.memory
+    )
+    record(results, f"{prefix}/RemNaN_and_Interp", times, peak, nstations, nlevels)
+
+    eargs = argparse.Namespace(station=None)
+    (success, emitted), times, peak = measure(
+        lambda p: emit_ascents(eargs, "madis", path, None, raob, stations, p),
+        lambda: (copy.deepcopy(profiles),),
+        args.repeat,
+        args.memory,
+    )
+    fcs = [fc for fc, _file, _archive in emitted]
+    nlevels = sum(len(fc.features) for fc in fcs)
+    record(results, f"{prefix}/emit_ascents", times, peak, len(fcs), nlevels)
+    bench_write(args, prefix, "madis", fcs, stations, results, workdir)
+
+
+def scalar_profile(temp, dewpoint, pressure):
+    """derived_profile the way it used to be done, one level at a time"""
+    result = {k: [] for k in ("theta", "theta_e", "mixing_ratio", "rh", "wet_bulb")}
+    kappa = thermodynamics.Rs_da / thermodynamics.Cp_da
+    for t, td, p in zip(temp.tolist(), dewpoint.tolist(), pressure.tolist()):
+        e = thermodynamics.VaporPressure(td - thermodynamics.degCtoK)
+        es = thermodynamics.VaporPressure(t - thermodynamics.degCtoK)
+        rh = 100.0 * e / es
+        # Theta() itself prints a warning for every level above 20 hPa
+        result["theta"].append(t * (1000.0 / p) ** kappa)
+        result["theta_e"].append(thermodynamics.ThetaE_Bolton(t, p * 100.0, e))
+        result["mixing_ratio"].append(thermodynamics.MixRatio(e, p * 100.0))
+        result["rh"].append(rh)
+        result["wet_bulb"].append(
+            thermodynamics.WetBulb(t - thermodynamics.degCtoK, rh)
+        )
+    return result
+
+
+def bench_thermo(args, rng, levels, results):
+    prefix = f"thermo/levels={levels}"
+    n = args.messages
+    profiles = []
+    for _ in range(n):
+        _height, temp, dewpoint, pres, _ws, _wd = synthetic_profile(rng, levels, 200.0)
+        profiles.append((temp, dewpoint, pres / 100.0))
+    nlevels = n * levels
+
+    def vectorized(profiles):
+        for temp, dewpoint, pres in profiles:
+            thermoutil.derived_profile(temp, dewpoint, pres)
+
+    def scalar(profiles):
+        for temp, dewpoint, pres in profiles:
+            scalar_profile(temp, dewpoint, pres)
+
+    for name, fn in (("derived_profile", vectorized), ("scalar", scalar)):
+        _, times, peak = measure(fn, lambda: (profiles,), args.repeat, args.memory)
+        record(results, f"{prefix}/{name}", times, peak, n, nlevels)
+
+    # level heights, MADIS style: from the station elevation up
+    def barometric(profiles):
+        for temp, _dewpoint, pres in profiles:
+            thermoutil.barometric_heights(0.0, temp[0], pres[0], pres)
+
+    def hypsometric(profiles):
+        for temp, dewpoint, pres in profiles:
+            thermoutil.hypsometric_heights(0.0, temp, dewpoint, pres)
+
+    for name, fn in (
+        ("barometric_heights", barometric),
+        ("hypsometric_heights", hypsometric),
+    ):
+        _, times, peak = measure(fn, lambda: (profiles,), args.repeat, args.memory)
+        record(results, f"{prefix}/{name}", times, peak, n, nlevels)
+
+    # parcels lifted from their LCL, table lookup against direct integration
+    thermoutil.moist_adiabat_table()
+    parcels = [
+        (rng.uniform(250.0, 300.0), rng.uniform(600.0, 1000.0), pres)
+        for _temp, _dewpoint, pres in profiles
+    ]
+    worst = 0.0
+    for name, fn in (
+        ("moist_adiabat", thermoutil.moist_adiabat),
+        ("moist_adiabat_lookup", thermoutil.moist_adiabat_lookup),
+    ):
+        (_, times, peak) = measure(
+            lambda parcels: [fn(*parcel) for parcel in parcels],
+            lambda: (parcels,),
+            args.repeat,
+            args.memory,
+        )
+        record(results, f"{prefix}/{name}", times, peak, n, nlevels)
+    for t0, p0, pres in parcels:
+        lifted = pres <= p0
+        d = thermoutil.moist_adiabat(t0, p0, pres)[lifted]
+        lookup = thermoutil.moist_adiabat_lookup(t0, p0, pres)[lifted]
+        worst = max(worst, float(np.max(np.abs(d - lookup))))
+    print(f"{prefix}/moist_adiabat_lookup: max deviation {worst:.4f} K")
+
+    # MetPy pulls in pyproj, and with eccodes already loaded two copies of
+    # PROJ end up in one process, which crashes at exit. Time it in a
+    # child process that never imports eccodes.
+    path = os.path.join(config.tmpdir, "thermo-profiles.npz")
+    np.savez(path, *(column for profile in profiles for column in profile))
+    child = subprocess.run(
+        [sys.executable, "-c", METPY_STAGE, path, str(args.repeat)],
+        capture_output=True,
+        text=True,
+    )
+    os.remove(path)
+    if child.returncode == 2:
+        print(f"{prefix}/metpy: skipped, MetPy not installed")
+        return
+    if child.returncode:
+        logging.error(f"{prefix}/metpy: exit status {child.returncode}")
+        logging.error(child.stderr)
+        return
+    times = json.loads(child.stdout)
+    record(results, f"{prefix}/metpy", times, None, n, nlevels)
+
+
+def compare(baseline, results, tolerance):
+    """return the list of (key, baseline, current) regressions"""
+    regressions = []
+    for key, cur in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]["best"]
+        if cur["best"] > base * (1.0 + tolerance):
+            regressions.append((key, base, cur["best"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark the decode -> convert -> write pipeline",
+        add_help=True,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", default=False)
+    parser.add_argument(
+        "--levels",
+        nargs="+",
+        type=int,
+        default=[100, 1000, 5000],
+        help="BUFR level counts to benchmark",
+    )
+    parser.add_argument(
+        "--messages",
+        action="store",
+        type=int,
+        default=20,
+        help="number of BUFR messages per level count",
+    )
+    parser.add_argument(
+        "--stations",
+        nargs="+",
+        type=int,
+        default=[10, 100, 500],
+        help="MADIS station counts to benchmark",
+    )
+    parser.add_argument(
+        "--madis-levels",
+        action="store",
+        type=int,
+        default=60,
+        help="significant temperature levels per MADIS station",
+    )
+    parser.add_argument(
+        "--only",
+        choices=["bufr", "madis", "thermo"],
+        default=None,
+        help="run one pipeline",
+    )
+    parser.add_argument("--hstep", action="store", type=int, default=100)
+    parser.add_argument("--thinning", choices=["adaptive", "hstep"], default="hstep")
+    parser.add_argument("--repeat", action="store", type=int, default=3)
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        default=False,
+        help="add a tracemalloc run per stage to report peak memory",
+    )
+    parser.add_argument("--seed", action="store", type=int, default=4711)
+    parser.add_argument(
+        "--baseline", action="store", default=None, help="JSON baseline to compare"
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store",
+        default=None,
+        help="write results as JSON baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        action="store",
+        type=float,
+        default=0.2,
+        help="relative slowdown against baseline considered a regression",
+    )
+    parser.add_argument("--tmpdir", action="store", default=None)
+
+    args = parser.parse_args()
+
+    level = logging.WARNING
+    if args.verbose:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+
+    rng = np.random.default_rng(args.seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as workdir:
+        config.tmpdir = workdir
+        if args.only in (None, "bufr"):
+            for levels in args.levels:
+                bench_bufr(args, rng, levels, results, workdir)
+        if args.only in (None, "madis"):
+            for nstations in args.stations:
+                bench_madis(args, rng, nstations, results, workdir)
+        if args.only in (None, "thermo"):
+            for levels in args.levels:
+                bench_thermo(args, rng, levels, results)
+
+    if args.save_baseline:
+        bl = {
+            "generated": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "args": {
+                k: v
+                for k, v in vars(args).items()
+                if k not in ("baseline", "save_baseline")
+            },
+            "results": results,
+        }
+        with open(args.save_baseline, "w") as f:
+            json.dump(bl, f, indent=config.INDENT)
+        logging.debug(f"baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(baseline, results, args.tolerance)
+        for key, base, cur in regressions:
+            print(
+                f"REGRESSION {key}: {base * 1000:.2f}ms -> {cur * 1000:.2f}ms"
+                f" ({(cur / base - 1) * 100:+.0f}%)",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+binary columnar encoding of detail files
+
+an ascent is written as one little-endian column per value, so a
+client can map the file, or fetch it as an ArrayBuffer, and use the
+columns as typed arrays without parsing:
+
+    header      magic "RSAB", u8 version, u8 codec, u16 columns,
+                u32 levels, u32 length of the properties
+    properties  the FeatureCollection properties as UTF-8 JSON,
+                padded with blanks to a multiple of 8 bytes
+    directory   per column: 12s name (pack() refuses longer ones),
+                4s dtype ("<f8", "<i4", "zvd"),
+                u32 offset from start of file, u32 length in bytes,
+                f8 scale, f8 bias
+    data        the columns, each starting at a multiple of 8 bytes
+
+a value is bias + stored * scale. The raw codec stores doubles with
+scale 1 and bias 0, NaN marks a missing value. The quantized codec
+stores int32 with the precision the GeoJSON output rounds to
+(config.BINARY_COLUMNS), MISSING_INT marks a missing value.
+
+The delta codec stores the same scaled integers as first-order
+differences to the previous present value, zigzag-mapped to unsigned
+and written as LEB128 varints, shifted by one so that 0 marks a missing
+value. Values which change smoothly from level to level shrink to one
+or two bytes, and the result compresses well at a low brotli quality;
+such files are written brotli-compressed as *.bin.br.
+
+encode_chunked() writes the same columns split into pressure bands
+behind an index, for clients which only need the lower atmosphere.
+"""
+
+import array
+import json
+import math
+import struct
+import sys
+
+import config
+
+MAGIC = b"RSAB"
+VERSION = 1
+CODECS = ["raw", "quantized", "delta"]
+
+MISSING_INT = -(2**31)
+
+_HEADER = struct.Struct("<4sBBHII")
+_COLUMN = struct.Struct("<12s4sIIdd")
+COLUMN_NAME_SIZE = 12
+
+CHUNK_MAGIC = b"RSAC"
+_CHUNK_HEADER = struct.Struct("<4sBBHI")
+_BAND = struct.Struct("<ddIIII")
+CHUNK_HEADER_SIZE = _CHUNK_HEADER.size
+
+
+def _pad(n):
+    return -n % 8
+
+
+def columns(fc):
+    """
+    the per-level values of an ascent FeatureCollection as
+    {name: [float, ...]}, NaN where a level lacks a value
+    """
+    nan = float("nan")
+    cols = {name: [] for name, _ in config.BINARY_COLUMNS}
+    for f in fc.features:
+        lon, lat, height = f.geometry["coordinates"]
+        p = f.properties
+        for name, _ in config.BINARY_COLUMNS:
+            if name == "lon":
+                v = lon
+            elif name == "lat":
+                v = lat
+            elif name == "height":
+                v = height
+            else:
+                v = p.get(name, nan)
+            cols[name].append(float(v))
+    return cols
+
+
+def _typed(typecode, values):
+    a = array.array(typecode, values)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+
+def zigzag_varints(q):
+    """
+    encode a list of ints (None for missing) as shifted zigzag LEB128
+    varints of their first-order differences
+    """
+    out = bytearray()
+    previous = 0
+    for v in q:
+        if v is None:
+            out.append(0)
+            continue
+        d = v - previous
+        previous = v
+        n = (d << 1 if d >= 0 else (-d << 1) - 1) + 1
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+
+def zigzag_values(b):
+    """
+    inverse of zigzag_varints
+    """
+    q = []
+    previous = 0
+    n = shift = 0
+    for byte in b:
+        n |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if n == 0:
+            q.append(None)
+        else:
+            n -= 1
+            previous += n >> 1 if not n & 1 else -((n + 1) >> 1)
+            q.append(previous)
+        n = shift = 0
+    return q
+
+
+def pack(properties, cols, codec="quantized", nlevels=None):
+    """
+    encode a list of (name, [float, ...], precision) columns, NaN for
+    missing values, plus a JSON-serializable properties dict
+    """
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec {codec}, use one of {CODECS}")
+    if nlevels is None:
+        nlevels = len(cols[0][1]) if cols else 0
+
+    props = json.dumps(properties, separators=(",", ":")).encode(config.CHARSET)
+    props += b" " * _pad(_HEADER.size + len(props))
+
+    blobs = []
+    for name, values, precision in cols:
+        if len(name.encode()) > COLUMN_NAME_SIZE:
+            raise ValueError(
+                f"column name {name!r} longer than {COLUMN_NAME_SIZE} bytes"
+            )
+        if codec == "raw":
+            blobs.append((name, b"<f8", 1.0, 0.0, _typed("d", values)))
+            continue
+        if codec == "delta":
+            q = [None if math.isnan(v) else round(v / precision) for v in values]
+            blobs.append((name, b"zvd", precision, 0.0, zigzag_varints(q)))
+            continue
+        bias = 0.0
+        present = [v for v in values if not math.isnan(v)]
+        if name == "time" and present:
+            # epoch seconds need a bias to fit int32 at 0.01s
+            bias = float(math.floor(min(present)))
+        q = [
+            MISSING_INT if math.isnan(v) else round((v - bias) / precision)
+            for v in values
+        ]
+        blobs.append((name, b"<i4", precision, bias, _typed("i", q)))
+
+    offset = _HEADER.size + len(props) + _COLUMN.size * len(blobs)
+    directory = []
+    data = []
+    for name, dtype, scale, bias, b in blobs:
+        directory.append(
+            _COLUMN.pack(name.encode(), dtype, offset, len(b), scale, bias)
+        )
+        data.append(b + b"\0" * _pad(len(b)))
+        offset += len(b) + _pad(len(b))
+
+    header = _HEADER.pack(
+        MAGIC, VERSION, CODECS.index(codec), len(blobs), nlevels, len(props)
+    )
+    return b"".join([header, props] + directory + data)
+
+
+def unpack(b):
+    """
+    inverse of pack: return (properties, {name: [float, ...]}),
+    missing values as NaN
+    """
+    magic, version, codec, ncols, nlevels, plen = _HEADER.unpack_from(b, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a version {VERSION} binary file")
+    props = json.loads(b[_HEADER.size : _HEADER.size + plen])
+
+    cols = {}
+    pos = _HEADER.size + plen
+    for _ in range(ncols):
+        name, dtype, offset, nbytes, scale, bias = _COLUMN.unpack_from(b, pos)
+        pos += _COLUMN.size
+        name = name.rstrip(b"\0").decode()
+        dtype = dtype.rstrip(b"\0")
+        data = b[offset : offset + nbytes]
+        if dtype == b"<f8":
+            a = array.array("d")
+            a.frombytes(data)
+            if sys.byteorder == "big":
+                a.byteswap()
+            cols[name] = a.tolist()
+            continue
+        if dtype == b"zvd":
+            q = zigzag_values(data)
+        else:
+            a = array.array("i")
+            a.frombytes(data)
+            if sys.byteorder == "big":
+                a.byteswap()
+            q = [None if v == MISSING_INT else v for v in a]
+        digits = max(0, round(-math.log10(scale)))
+        cols[name] = [
+            float("nan") if v is None else round(bias + v * scale, digits) for v in q
+        ]
+    return props, cols
+
+
+def encode(fc, codec="quantized"):
+    """
+    return the binary encoding of an ascent FeatureCollection
+    """
+    cols = columns(fc)
+    return pack(
+        fc.properties,
+        [(name, cols[name], precision) for name, precision in config.BINARY_COLUMNS],
+        codec=codec,
+        nlevels=len(fc.features),
+    )
+
+
+def decode(b):
+    """
+    inverse of encode: return (properties, {name: [float, ...]}),
+    missing values as NaN
+    """
+    return unpack(b)
+
+
+def suffix(codec):
+    """
+    file name suffix of a binary detail file written with codec
+    """
+    if codec == "delta":
+        return config.BINARY_SUFFIX + ".br"
+    return config.BINARY_SUFFIX
+
+
+def encode_chunked(fc, codec="quantized", bands=config.CHUNK_BANDS_HPA):
+    """
+    encode an ascent split into pressure bands, each band a complete
+    pack()ed blob, behind an index, so that a client can fetch the
+    header and then just the bands it needs with HTTP range requests:
+
+        header      magic "RSAC", u8 version, u8 codec, u16 bands,
+                    u32 length of the properties
+        properties  as in encode()
+        index       per band: f8 bottom, f8 top (hPa), u32 offset from
+                    start of file, u32 length in bytes, u32 levels, u32 0
+        data        the bands, surface first, each 8-byte aligned
+
+    a level belongs to the band with bottom >= pressure > top, the
+    lowest band also takes levels below its bottom. Levels without a
+    pressure are left out. A band without levels has an index entry of
+    length 0 and no data. The delta codec is not brotli-compressed
+    here, range requests need plain files.
+    """
+    cols = columns(fc)
+    pressure = cols["pressure"]
+
+    props = json.dumps(fc.properties, separators=(",", ":")).encode(config.CHARSET)
+    props += b" " * _pad(_CHUNK_HEADER.size + len(props))
+
+    blobs = []
+    for bottom, top in zip(bands, bands[1:]):
+        # the lowest band takes anything below its top
+        rows = [
+            i
+            for i, p in enumerate(pressure)
+            if p > top and (p <= bottom or bottom == bands[0])
+        ]
+        if not rows:
+            blobs.append((bottom, top, 0, b""))
+            continue
+        b = pack(
+            {},
+            [
+                (name, [cols[name][i] for i in rows], precision)
+                for name, precision in config.BINARY_COLUMNS
+            ],
+            codec=codec,
+            nlevels=len(rows),
+        )
+        blobs.append((bottom, top, len(rows), b))
+
+    offset = _CHUNK_HEADER.size + len(props) + _BAND.size * len(blobs)
+    index = []
+    data = []
+    for bottom, top, nlevels, b in blobs:
+        index.append(_BAND.pack(bottom, top, offset, len(b), nlevels, 0))
+        data.append(b + b"\0" * _pad(len(b)))
+        offset += len(b) + _pad(len(b))
+
+    header = _CHUNK_HEADER.pack(
+        CHUNK_MAGIC, VERSION, CODECS.index(codec), len(blobs), len(props)
+    )
+    return b"".join([header, props] + index + data)
+
+
+def chunk_index(b):
+    """
+    return (properties, [(bottom, top, offset, nbytes, nlevels), ...])
+    from the beginning of a chunked file - header_size(b) bytes of it
+    """
+    magic, version, codec, nbands, plen = _CHUNK_HEADER.unpack_from(b, 0)
+    if magic != CHUNK_MAGIC or version != VERSION:
+        raise ValueError(f"not a version {VERSION} chunked binary file")
+    props = json.loads(b[_CHUNK_HEADER.size : _CHUNK_HEADER.size + plen])
+    pos = _CHUNK_HEADER.size + plen
+    bands = []
+    for _ in range(nbands):
+        bottom, top, offset, nbytes, nlevels, _ = _BAND.unpack_from(b, pos)
+        pos += _BAND.size
+        bands.append((bottom, top, offset, nbytes, nlevels))
+    return props, bands
+
+
+def header_size(b):
+    """
+    length of header, properties and index of a chunked file,
+    given at least its first CHUNK_HEADER_SIZE bytes
+    """
+    magic, version, codec, nbands, plen = _CHUNK_HEADER.unpack_from(b, 0)
+    return _CHUNK_HEADER.size + plen + _BAND.size * nbands
+
+
+def decode_chunked(b, top=None):
+    """
+    decode a chunked file like decode(), keeping only the bands
+    below pressure top (hPa), all bands if top is None
+    """
+    props, bands = chunk_index(b)
+    cols = {name: [] for name, _ in config.BINARY_COLUMNS}
+    for bottom, btop, offset, nbytes, nlevels in bands:
+        if top is not None and bottom <= top:
+            break
+        if not nbytes:
+            continue
+        _, c = unpack(b[offset : offset + nbytes])
+        for name in cols:
+            cols[name].extend(c[name])
+    return props, cols
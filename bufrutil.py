@@ -25,7 +25,11 @@ from eccodes import (
 
 import geojson
 
-from config import FAKE_TIME_STEPS, MAX_FLIGHT_DURATION
+from config import FAKE_TIME_STEPS, MAX_FLIGHT_DURATION, THIN_MIN_STEP
+
+import metrics
+
+from thinutil import thin
 
 
 class MissingKeyError(Exception):
@@ -165,6 +169,7 @@ def bufr_decode(
             else:
                 timePeriod = fakeTimeperiod
                 fakeTimeperiod += FAKE_TIME_STEPS
+                metrics.count("fixups_total", key=k)
                 if k not in fixups:
                     logging.debug(
                         f"FIXUP timePeriod fakeTimes:{fakeTimes} fakeTimeperiod={fakeTimeperiod}"
@@ -182,6 +187,7 @@ def bufr_decode(
                     sample[k] = value
                 else:
                     if fakeDisplacement and k in replaceable:
+                        metrics.count("fixups_total", key=k)
                         if k not in fixups:
                             logging.debug(f"--FIXUP  key {k}")
                             fixups.append(k)
@@ -199,11 +205,17 @@ def bufr_decode(
             samples.append(sample)
 
     logging.debug(
-        (
-            f"samples used={len(samples)}, invalid samples="
-            f"{invalidSamples}, skipped header keys={missingHdrKeys},"
-            f" missing values={missingValues}"
-        )
+        "samples used=%d, invalid samples=%d, skipped header keys=%d,"
+        " missing values=%d",
+        len(samples),
+        invalidSamples,
+        missingHdrKeys,
+        missingValues,
+    )
+    metrics.count("messages_decoded_total")
+    metrics.count("samples_used_total", len(samples))
+    metrics.count(
+        "samples_dropped_total", int(num_samples) - len(samples), reason="invalid"
     )
 
     codes_release(ibufr)
@@ -227,7 +239,8 @@ def bufr_qc(args, h, s, fn, archive):
 
 def process_bufr(args, source, f, fn, archive):
     try:
-        (h, s) = bufr_decode(f, fn, archive, args)
+        with metrics.timer("bufr_decode"):
+            (h, s) = bufr_decode(f, fn, archive, args)
 
     except Exception as e:
         logging.warning(f"exception processing {fn} e={e}")
@@ -326,26 +339,47 @@ def convert_bufr_to_geojson(args, h):
     fc.properties = properties
     lat_t = fc.properties["lat"]
     lon_t = fc.properties["lon"]
-    previous_elevation = fc.properties["elevation"] - args.hstep
+    step = args.hstep if args.thinning == "hstep" else 0
+    previous_elevation = fc.properties["elevation"] - step
+    thinned = 0
 
+    # the rising part of the flight, with --thinning hstep
+    # no more than one sample every hstep metres
+    levels = []
     for s in samples:
-        lat = lat_t + s["latitudeDisplacement"]
-        lon = lon_t + s["longitudeDisplacement"]
-        gpheight = s["nonCoordinateGeopotentialHeight"]
-
-        delta = timedelta(seconds=s["timePeriod"])
-        sampleTime = takeoff + delta
-
-        height = geopotential_height_to_height(gpheight)
-        if height < previous_elevation + args.hstep:
+        height = geopotential_height_to_height(s["nonCoordinateGeopotentialHeight"])
+        if height < previous_elevation + step:
+            thinned += 1
             continue
         previous_elevation = height
-
         u, v = wind_to_UV(s["windSpeed"], s["windDirection"])
+        levels.append((s, height, u, v))
+
+    if args.thinning == "adaptive" and levels:
+        keep = thin(
+            [s["pressure"] for s, _, _, _ in levels],
+            [height for _, height, _, _ in levels],
+            {
+                "temp": [s["airTemperature"] for s, _, _, _ in levels],
+                "dewpoint": [s["dewpointTemperature"] for s, _, _, _ in levels],
+                "wind_u": [u for _, _, u, _ in levels],
+                "wind_v": [v for _, _, _, v in levels],
+                "lon": [lon_t + s["longitudeDisplacement"] for s, _, _, _ in levels],
+                "lat": [lat_t + s["latitudeDisplacement"] for s, _, _, _ in levels],
+            },
+            min_step=THIN_MIN_STEP,
+        )
+        thinned += len(levels) - len(keep)
+        levels = [levels[i] for i in keep]
+
+    for s, height, u, v in levels:
+        lat = lat_t + s["latitudeDisplacement"]
+        lon = lon_t + s["longitudeDisplacement"]
+        sampleTime = takeoff + timedelta(seconds=s["timePeriod"])
 
         properties = {
             "time": sampleTime.timestamp(),
-            "gpheight": round(gpheight, 2),
+            "gpheight": round(s["nonCoordinateGeopotentialHeight"], 2),
             "temp": round(s["airTemperature"], 2),
             "dewpoint": round(s["dewpointTemperature"], 2),
             "pressure": round(s["pressure"] / 100.0, 2),
@@ -357,7 +391,10 @@ def convert_bufr_to_geojson(args, h):
             properties=properties,
         )
         fc.features.append(f)
-    fc.properties["lastSeen"] = sampleTime.timestamp()
+    lastSeen = takeoff + timedelta(seconds=samples[-1]["timePeriod"])
+    fc.properties["lastSeen"] = lastSeen.timestamp()
+    metrics.count("samples_dropped_total", thinned, reason=args.thinning)
+    metrics.observe("ascent_levels", len(fc.features), feed="gisc")
 
     duration = fc.properties["lastSeen"] - fc.properties["firstSeen"]
     if duration > MAX_FLIGHT_DURATION:
@@ -0,0 +1,147 @@
+"""
+roll finished months of detail files into per-station monthly archives
+
+walks {destdir}/{source}/{cc}/{subdir}/{year}/{month}/ and, for every
+station with *.geojson.br files in a month before the current one,
+(re)writes {station_id}_{year}{month}.month.bin from them - unless
+the archive is already newer than all of the station's files there.
+The individual detail files are left in place.
+
+example:
+    python compact.py --destdir /var/www/radiosonde.mah.priv.at/data/
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import sys
+from datetime import datetime
+
+import archiveutil
+
+import config
+
+import locks
+
+import metrics
+
+import pidfile
+
+import util
+
+
+def month_dirs(destdir, sources):
+    for source in sources:
+        top = pathlib.Path(destdir) / source
+        if not top.is_dir():
+            continue
+        # {cc}/{subdir}/{year}/{month}
+        for d in sorted(top.glob("*/*/*/*")):
+            if d.is_dir():
+                yield d
+
+
+def finished(d, now):
+    try:
+        year, month = int(d.parent.name), int(d.name)
+    except ValueError:
+        return False
+    return (year, month) < (now.year, now.month)
+
+
+def compact_month(args, d):
+    """
+    rebuild the stale archives in month directory d, return their number
+    """
+    stations = {}
+    for p in d.glob("*.geojson.br"):
+        station_id = p.name[: -len(".geojson.br")].rsplit("_", 2)[0]
+        stations.setdefault(station_id, []).append(p)
+
+    reldir = str(d.relative_to(args.destdir))
+    n = 0
+    for station_id, files in sorted(stations.items()):
+        path = archiveutil.archive_path(args.destdir, reldir, station_id)
+        newest = max(os.path.getmtime(p) for p in files)
+        if not args.force and util.age(path) > newest:
+            continue
+        fcs = [
+            util.read_json_file(p, useBrotli=True, asGeojson=True)
+            for p in sorted(files)
+        ]
+        util.write_file(archiveutil.build_archive(fcs), path)
+        logging.debug(f"{path}: {len(fcs)} ascents")
+        metrics.count("archives_written_total")
+        metrics.count("archive_ascents_total", len(fcs))
+        n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="compact finished months into per-station archives",
+        add_help=True,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", default=False)
+    parser.add_argument(
+        "--destdir", action="store", default=config.WWW_DIR + config.DATA_DIR
+    )
+    parser.add_argument("--sources", nargs="+", default=["gisc", "madis"])
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        default=False,
+        help="include the current month",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="rebuild archives even if newer than their detail files",
+    )
+    parser.add_argument("--tmpdir", action="store", default=None)
+    parser.add_argument(
+        "--metrics",
+        action="store",
+        default=None,
+        help="write run metrics to this file: Prometheus textfile, or JSON if *.json",
+    )
+    args = parser.parse_args()
+    if args.tmpdir:
+        config.tmpdir = args.tmpdir
+    if args.metrics:
+        metrics.enable()
+
+    level = logging.WARNING
+    if args.verbose:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+    os.umask(0o22)
+
+    try:
+        with pidfile.Pidfile(
+            config.COMPACT_LOCKFILE, log=logging.debug, warn=logging.debug
+        ):
+            now = datetime.utcnow()
+            n = 0
+            for d in month_dirs(args.destdir, args.sources):
+                if args.all or finished(d, now):
+                    # process.py --archive appends to archives while
+                    # holding this lock shared, so wait for a gap
+                    with locks.lock("details"), metrics.timer("compact_month"):
+                        n += compact_month(args, d)
+            logging.debug(f"{n} archives written")
+
+            if args.metrics:
+                util.write_file(metrics.render(args.metrics), args.metrics)
+            return 0
+
+    except pidfile.ProcessRunningException:
+        logging.warning(f"the pid file {config.COMPACT_LOCKFILE} is in use, exiting.")
+        return -1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
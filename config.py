@@ -5,6 +5,15 @@ MAX_FLIGHT_DURATION = 3600 * 5  # rather unlikely
 # see examples/polyfit.py
 # y = 6.31426 * x + -0.00019 * x^2 + -373.12281
 ASCENT_RATE = 6.3 # m/s = ca 380m/min
+# "constant": ASCENT_RATE, "quadratic": height above launch (m) after
+# t seconds = ASCENT_POLY[0] * t + ASCENT_POLY[1] * t**2.
+# ASCENT_POLY is the fit above without its constant. That fit was made
+# against absolute elevation, so it is not exact for height above launch:
+# against the fit with its constant, levels come out 59 s early at
+# launch, 66 s at 10 km and 91 s at 30 km. examples/polyfit.py now fits
+# height above launch through the origin; rerun it to replace ASCENT_POLY.
+ASCENT_MODEL = "constant"
+ASCENT_POLY = (6.31426, -0.00019)
 
 BROTLI_SUMMARY_QUALITY = 11  # 7
 
@@ -18,10 +27,19 @@ SPOOLDIR_GISC_TOKYO = r"/var/spool/gisc-tokyo/"
 PROCESSED = r"processed"
 FAILED = r"failed"
 INCOMING = r"incoming"
+TS_TIMESTAMP = ".timestamp"
+# sidecars of the former per-file state, taken over by spoolutil.py
 TS_PROCESSED = ".processed"
 TS_FAILED = ".failed"
-TS_TIMESTAMP = ".timestamp"
+# state of the input files, see spoolutil.py
+SPOOL_STATE_DB = r"/var/spool/radiosonde/spool-state.sqlite3"
+SPOOL_STATE_RETENTION = 86400 * 30  # secs after moving out of incoming
 LOCKFILE = "/var/lock/process-radiosonde.pid"
+REBUILD_LOCKFILE = "/var/lock/gensummary-radiosonde.pid"
+COMPACT_LOCKFILE = "/var/lock/compact-radiosonde.pid"
+LOCK_DIR = "/var/lock/radiosonde/"
+LOCK_POLL_INTERVAL = 0.5  # secs
+SUMMARY_LOCK_TIMEOUT = 600  # secs
 DATA_DIR = "data/"
 STATIC_DIR = "static/"
 WWW_DIR = "/var/www/radiosonde.mah.priv.at/"
@@ -29,14 +47,157 @@ STATION_LIST = WWW_DIR + STATIC_DIR + "station_list.json"
 MADIS_DATA = WWW_DIR + DATA_DIR + "madis/"
 GISC_DATA = WWW_DIR + DATA_DIR + "gisc/"
 STATION_TXT = "station_list.txt"
+# binary snapshot written next to STATION_LIST, see stationutil.py
+REGISTRY_SUFFIX = ".registry.bin"
+NEARBY_KM = 25  # registered stations reported near an unregistered one
+# reverse geocoded names of unregistered stations, see geocodeutil.py
+GEOCODE_CACHE = "geocode_cache.json"
+GEOCODE_CACHE_DIGITS = 3  # decimals of lat/lon in the cache key, ~100m
 CHARSET = "utf-8"
 tmpdir = "/tmp"
 INDENT = 4
 SUMMARY = "summary.geojson.br"
 
+# process-wide caches in geojsonutil: directories known to exist,
+# and detail file paths per (source, station, syn time)
+DIRECTORY_CACHE_SIZE = 16384
+DETAIL_PATH_CACHE_SIZE = 16384
+
+# metric name prefix in Prometheus textfile output
+METRICS_PREFIX = "radiosonde"
+
+# --profile output: one directory per run below PROFILE_DIR
+# (or next to the --metrics file), keep the newest PROFILE_KEEP_RUNS
+PROFILE_DIR = "/var/tmp/radiosonde-profiles"
+PROFILE_KEEP_RUNS = 48
+PROFILE_SAMPLE_INTERVAL = 0.005  # secs, sampling profiler
+PROFILE_TOP = 10  # slowest input files to report
+
+# startup budget for "import process", checked by importtime.py;
+# the decoder backends and their dependencies must load lazily
+IMPORT_TIME_BUDGET_MS = 100
+LAZY_IMPORTS = [
+    "bufrutil",
+    "netcdfutil",
+    "eccodes",
+    "netCDF4",
+    "scipy",
+    "numpy",
+    "geojson",
+]
+
 # after 3 days move to processed
 KEEP_MADIS_PROCESSED_FILES = 86400 * 3
 
 # added to featurecollection.properties.fmt = FORMAT_VERSION
 # 4 - using deep subdirs year/month under station
 FORMAT_VERSION = 5
+
+# compact (columnar) summary, written next to the GeoJSON summary:
+# summary.geojson.br -> summary.compact.json.br, or .compact.bin.br
+COMPACT_SUFFIX = {"json": ".compact.json", "delta": ".compact.bin"}
+COMPACT_ENCODING = "columnar-2"
+
+# binary columnar detail files (--binary), written next to the
+# *.geojson.br files: (column, precision of the quantized codec)
+BINARY_SUFFIX = ".bin"
+BINARY_COLUMNS = [
+    ("time", 0.01),
+    ("lon", 1e-6),
+    ("lat", 1e-6),
+    ("height", 0.01),
+    ("gpheight", 0.01),
+    ("temp", 0.01),
+    ("dewpoint", 0.01),
+    ("pressure", 0.01),
+    ("wind_u", 0.01),
+    ("wind_v", 0.01),
+]
+
+# brotli quality for the delta codec (--binary delta, --compact-codec delta):
+# the varints need far less effort than text to compress well
+BINARY_BROTLI_QUALITY = 5
+COMPACT_PRECISION = {
+    "lon": 1e-6,
+    "lat": 1e-6,
+    "elevation": 0.01,
+    "processed": 1,
+    "cape": 1,
+    "cin": 1,
+    "freezing_level": 1,
+    "preview": 1,
+}
+
+# convective indices stored in each ascent's properties, decimals kept,
+# see thermoutil.convective_indices; SUMMARY_INDICES also go to the summary
+INDEX_DECIMALS = {
+    "lcl_pressure": 1,
+    "lfc_pressure": 1,
+    "el_pressure": 1,
+    "cape": 0,
+    "cin": 0,
+    "freezing_level": 0,
+}
+SUMMARY_INDICES = ["cape", "cin", "freezing_level"]
+# cache of the moist adiabat lookup table, rebuilt if missing or unreadable
+MOIST_ADIABAT_CACHE = "/var/tmp/radiosonde-moist-adiabats.npy"
+
+# pressure bands (hPa, surface first) of chunked detail files (--chunked)
+CHUNK_SUFFIX = ".chunks.bin"
+CHUNK_BANDS_HPA = [1100, 850, 700, 500, 300, 200, 100, 50, 20, 10, 0]
+
+# per-station monthly archives (--archive, compact.py)
+ARCHIVE_SUFFIX = ".month.bin"
+ARCHIVE_CODEC = "delta"
+
+# merging duplicate reports of one ascent (--merge): the detail trees
+# searched for them, and the rank of the reporting formats - on equal
+# syn_timestamp, the higher one wins, see mergeutil.py
+MERGE_SOURCES = ["gisc", "madis"]
+MERGE_RANK = {"BUFR": 1, "netCDF": 0}
+
+# adaptive thinning of BUFR samples (--thinning adaptive), see thinutil.py:
+# the largest deviation of a dropped level from the linear interpolation
+# between the levels kept (K, m/s, degrees)
+THIN_TOLERANCE = {
+    "temp": 0.3,
+    "dewpoint": 1.0,
+    "wind_u": 1.0,
+    "wind_v": 1.0,
+    "lon": 0.001,
+    "lat": 0.001,
+}
+# and keep at most one level per THIN_MIN_STEP metres, the default
+# --hstep, so that sensor noise never keeps more levels than hstep does
+THIN_MIN_STEP = 100
+
+# previews of the ascents (--preview), see previewutil.py: the largest
+# deviation from the full profile per column (K, m/s, degrees), and the
+# levels kept in any case (hPa) - the mandatory ones
+PREVIEW_SUFFIX = ".preview.json.br"
+PREVIEW_TOLERANCE = {
+    "temp": 0.5,
+    "dewpoint": 1.0,
+    "wind_u": 2.5,
+    "wind_v": 2.5,
+    "lon": 0.01,
+    "lat": 0.01,
+}
+PREVIEW_KEEP_HPA = [
+    1000,
+    925,
+    850,
+    700,
+    500,
+    400,
+    300,
+    250,
+    200,
+    150,
+    100,
+    70,
+    50,
+    30,
+    20,
+    10,
+]
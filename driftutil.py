@@ -0,0 +1,99 @@
+"""
+simulated balloon trajectories for ascents which only report winds
+
+ascent_times() turns heights above the launch site into seconds after
+launch, with either the constant config.ASCENT_RATE or the quadratic
+fit of examples/polyfit.py, config.ASCENT_POLY:
+
+    height above launch = a * t + b * t**2
+
+the constant model is the same formula with b = 0, so both cost the same.
+
+drift() integrates the positions from the winds: the displacement of
+each level is u * dt and v * dt, converted to degrees at the mean
+latitude of the step, and summed up with np.cumsum. Both work along
+the last axis, on one profile or on a (stations, levels) array padded
+with NaN.
+"""
+
+from math import pi
+
+import numpy as np
+
+import config
+
+from constants import mperdeg
+
+MISSING = -9999.0
+
+ASCENT_MODELS = ["constant", "quadratic"]
+
+
+def ascent_coefficients(model=None):
+    """
+    (a, b) of the ascent model, config.ASCENT_MODEL by default
+    """
+    model = model or config.ASCENT_MODEL
+    if model == "constant":
+        return config.ASCENT_RATE, 0.0
+    if model == "quadratic":
+        return config.ASCENT_POLY
+    raise ValueError(f"unknown ascent model {model!r}, not one of {ASCENT_MODELS}")
+
+
+def ascent_times(dz, model=None):
+    """
+    seconds after launch at heights dz (m) above the launch site
+    """
+    a, b = ascent_coefficients(model)
+    dz = np.asarray(dz, dtype=np.float64)
+    # the root of b * t**2 + a * t - dz which is 0 at dz = 0, in
+    # the form which stays exact as b goes to 0; the discriminant
+    # only turns negative above the top of the parabola, some 50 km up
+    with np.errstate(invalid="ignore"):
+        return 2.0 * dz / (a + np.sqrt(np.maximum(a * a + 4.0 * b * dz, 0.0)))
+
+
+def _previous(ok):
+    """
+    the index of the previous level where ok is set, -1 if none
+    """
+    n = ok.shape[-1]
+    idx = np.maximum.accumulate(np.where(ok, np.arange(n), -1), axis=-1)
+    first = np.full(idx.shape[:-1] + (1,), -1)
+    return np.concatenate([first, idx[..., :-1]], axis=-1)
+
+
+def drift(lat0, lon0, secs, u, v):
+    """
+    latitudes and longitudes of a balloon launched at lat0, lon0 and
+    carried by the wind u, v (m/s) at levels reached secs after launch.
+
+    a level without a time or a wind (NaN or the MADIS -9999 sentinel)
+    stays where the previous one was; the next level with a wind is
+    moved over the whole time since the last one which had a wind.
+    """
+    secs = np.asarray(secs, dtype=np.float64)
+    u = np.asarray(u, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    lat0 = np.asarray(lat0, dtype=np.float64)[..., None]
+    lon0 = np.asarray(lon0, dtype=np.float64)[..., None]
+
+    with np.errstate(invalid="ignore"):
+        ok = np.isfinite(secs) & (u > MISSING) & (v > MISSING)
+        prev = _previous(ok)
+        before = np.take_along_axis(secs, np.maximum(prev, 0), axis=-1)
+        dt = np.where(ok, secs - np.where(prev < 0, 0.0, before), 0.0)
+        dlat = np.where(ok, v * dt, 0.0) / mperdeg
+        # lat0 leads the sum, so it adds up in the order of a loop
+        lat = np.cumsum(
+            np.concatenate([np.broadcast_to(lat0, dlat.shape[:-1] + (1,)), dlat], -1),
+            axis=-1,
+        )
+        mid = lat[..., :-1] + dlat / 2
+        dlon = np.where(ok, u * dt, 0.0) / (np.cos(mid / 180 * pi) * mperdeg)
+        lon = np.cumsum(
+            np.concatenate([np.broadcast_to(lon0, dlon.shape[:-1] + (1,)), dlon], -1),
+            axis=-1,
+        )
+    return lat[..., 1:], lon[..., 1:]
@@ -22,7 +22,7 @@ for station in ["11010", "11035", "11120", "11240", "11520", "11747", "11952"]:
         print(syn_time, src, fn)
         if src == "madis":
             continue
-        adf, metadata = st.as_dataframe(date=syn_time, relativeTime=True, relativeElevation=False)
+        adf, metadata = st.as_dataframe(date=syn_time, relativeTime=True, relativeElevation=True)
         adf.drop(columns=['pressure', 'gpheight', 'temperature', 'dewpoint',
               'u_wind', 'v_wind',  'latitude', 'longitude'])
         if not df.empty:
@@ -33,9 +33,10 @@ for station in ["11010", "11035", "11120", "11240", "11520", "11747", "11952"]:
 
 # https://machinelearningmastery.com/curve-fitting-with-python/
 
-# define the true objective function
-def objective(x, a, b, c):
-	return a * x + b * x**2 + c
+# define the true objective function: height above launch after x seconds,
+# through the origin like driftutil.ascent_times() - config.ASCENT_POLY = (a, b)
+def objective(x, a, b):
+	return a * x + b * x**2
 
 x = df['time']
 y = df['elevation']
@@ -43,14 +44,14 @@ y = df['elevation']
 # curve fit
 popt, _ = curve_fit(objective, x, y)
 # summarize the parameter values
-a, b, c = popt
-print('y = %.5f * x + %.5f * x^2 + %.5f' % (a, b, c))
+a, b = popt
+print('y = %.5f * x + %.5f * x^2' % (a, b))
 # plot input vs output
 pyplot.scatter(x, y)
 # define a sequence of inputs between the smallest and largest known inputs
 x_line = arange(min(x), max(x), 1)
 # calculate the output for the range
-y_line = objective(x_line, a, b, c)
+y_line = objective(x_line, a, b)
 # create a line plot for the mapping function
 pyplot.plot(x_line, y_line, '--', color='red')
 pyplot.show()
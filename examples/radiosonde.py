@@ -3,6 +3,8 @@ import requests
 import json
 import geojson
 import brotli
+import struct
+import numpy as np
 import pandas as pd
 from metpy.units import pandas_dataframe_to_unit_arrays, units
 from datetime import datetime
@@ -143,7 +145,7 @@ class Station(object):
         else:
             return (df, gj["properties"])
 
-    def as_geojson(self, index=0, date=None):
+    def _select(self, index=0, date=None):
         a = None
         if date:
             if date.tzinfo is None or date.tzinfo.utcoffset(date) is None:
@@ -165,14 +167,120 @@ class Station(object):
                                   f"'{self.station_name}' ({self.station_id})"
                                   f" index {index}"))
 
-        base = (f"{self.site}/{self.data_dir}/"
+        return (f"{self.site}/{self.data_dir}/"
                 f"{a[1]}/{self.region}/{self.ident}/{a[2]}")
 
-        r = requests.get(base)
+    def as_geojson(self, index=0, date=None):
+        r = requests.get(self._select(index=index, date=date))
         if r.status_code == 404:
             return None
         return geojson.loads(brotli.decompress(r.content).decode())
 
+    def as_columns(self, index=0, date=None):
+        # binary columnar detail file, if the server writes them
+        # (process.py --binary): (properties, {column: numpy array})
+        url = self._select(index=index, date=date)
+        r = requests.get(url.replace(".geojson.br", ".bin"))
+        if r.status_code == 404:
+            # delta codec, brotli-compressed
+            r = requests.get(url.replace(".geojson.br", ".bin.br"))
+            if r.status_code == 404:
+                return None
+            return decode_columns(brotli.decompress(r.content))
+        return decode_columns(r.content)
+
+    def as_bands(self, index=0, date=None, top=100.):
+        # chunked detail file (process.py --chunked): read the index,
+        # then fetch only the pressure bands up to top hPa in one
+        # HTTP range request. (properties, {column: numpy array})
+        url = self._select(index=index, date=date).replace(
+            ".geojson.br", ".chunks.bin")
+        r = requests.get(url, headers={"Range": "bytes=0-4095"})
+        if r.status_code == 404:
+            return None
+        head = r.content
+        magic, version, codec, nbands, plen = struct.unpack_from(
+            "<4sBBHI", head, 0)
+        if magic != b"RSAC" or version != 1:
+            raise ValueError("not a version 1 chunked binary file")
+        size = 12 + plen + 32 * nbands
+        if len(head) < size:
+            head = requests.get(
+                url, headers={"Range": f"bytes=0-{size - 1}"}).content
+        properties = json.loads(head[12:12 + plen])
+
+        bands = []
+        for n in range(nbands):
+            bottom, btop, offset, nbytes, nlevels, _ = struct.unpack_from(
+                "<ddIIII", head, 12 + plen + 32 * n)
+            if bottom <= top:
+                break
+            if nbytes:
+                # bands without levels have no data
+                bands.append((offset, nbytes))
+        if not bands:
+            return properties, {}
+
+        first = bands[0][0]
+        last = bands[-1][0] + bands[-1][1]
+        r = requests.get(url, headers={"Range": f"bytes={first}-{last - 1}"})
+        body = r.content
+        if r.status_code == 200:
+            # server ignored the range
+            body = body[first:last]
+        parts = {}
+        for offset, nbytes in bands:
+            _, c = decode_columns(body[offset - first:offset - first + nbytes])
+            for k, v in c.items():
+                parts.setdefault(k, []).append(v)
+        return properties, {k: np.concatenate(v) for k, v in parts.items()}
+
+
+def decode_varints(b):
+    # shifted zigzag LEB128 varints of first-order differences,
+    # 0 = missing. see binaryutil.zigzag_varints
+    a = np.frombuffer(b, dtype=np.uint8)
+    ends = np.flatnonzero(a < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    n = np.zeros(len(ends), dtype=np.uint64)
+    for k in range(int(lengths.max()) if len(ends) else 0):
+        m = lengths > k
+        n[m] |= (a[starts[m] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+    missing = n == 0
+    z = n[~missing] - np.uint64(1)
+    d = (z >> np.uint64(1)).astype(np.int64) * np.where(z & np.uint64(1), -1, 1)
+    d -= (z & np.uint64(1)).astype(np.int64)
+    values = np.full(len(n), np.nan)
+    values[~missing] = np.cumsum(d)
+    return values
+
+
+def decode_columns(b):
+    # see binaryutil.py for the layout
+    magic, version, codec, ncols, nlevels, plen = struct.unpack_from(
+        "<4sBBHII", b, 0)
+    if magic != b"RSAB" or version != 1:
+        raise ValueError("not a version 1 binary detail file")
+    properties = json.loads(b[16:16 + plen])
+    columns = {}
+    pos = 16 + plen
+    for _ in range(ncols):
+        name, dtype, offset, nbytes, scale, bias = struct.unpack_from(
+            "<12s4sIIdd", b, pos)
+        pos += 40
+        dtype = dtype.rstrip(b"\0").decode()
+        if dtype == "zvd":
+            a = bias + decode_varints(b[offset:offset + nbytes]) * scale
+        else:
+            a = np.frombuffer(b, dtype=dtype, count=nlevels, offset=offset)
+        if a.dtype.kind == "i":
+            missing = a == -2**31
+            a = bias + a * scale
+            a[missing] = np.nan
+        columns[name.rstrip(b"\0").decode()] = a
+    return properties, columns
+
 
 if __name__ == "__main__":
     from pprint import pprint
@@ -201,3 +309,9 @@ if __name__ == "__main__":
     df, metadata = st.as_dataframe(date=dt)
     pprint(metadata)
     print(df)
+
+    # or as numpy columns, without parsing GeoJSON
+    # metadata, columns = st.as_columns(date=dt)
+
+    # or just the levels up to 100 hPa
+    # metadata, columns = st.as_bands(date=dt, top=100)
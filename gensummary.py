@@ -6,14 +6,35 @@ import sys
 import os
 import logging
 import ciso8601
-import json
 from geojson import Feature, Point
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from operator import itemgetter
-import reverse_geocoder as rg
+
+import geocodeutil
+
+import locks
+
+import metrics
 
 import pidfile
 
+import profiling
+
+import stationutil
+
+from summaryutil import (
+    COMPACT_CODECS,
+    CompactSummary,
+    StationAscents,
+    late_ascents,
+    merge_late,
+    write_compact,
+    write_compact_summary,
+)
+
 import config
 
 import util
@@ -24,20 +45,16 @@ generate summary JSON file of all files under MADIS and GISC
 update the station_list.json from station_list.txt if older
 read the station_list.json file
 
-read the file tree of *.geojson.br files
-reconstruct summary
-compress and write
+read the file tree of *.geojson.br files, one WMO block
+(the {cc} directory level) at a time, in a process pool
+reconstruct summary, streaming each block's stations
+into the compressed output as it comes in
 
 """
 
 
-flights = {}
-missing = {}
-txtfrag = []
-
-
-def initialize_stations(txt_fn, json_fn):
-    US_STATES = [
+US_STATES = frozenset(
+    [
         "AK",
         "AL",
         "AR",
@@ -88,20 +105,25 @@ def initialize_stations(txt_fn, json_fn):
         "WV",
         "WY",
     ]
+)
 
+STATION_LINE = re.compile(
+    r"(?P<stn_wmoid>^\w+)\s+(?P<stn_lat>\S+)\s+(?P<stn_lon>\S+)\s+(?P<stn_altitude>\S+)(?P<stn_name>\D+)"
+)
+US_STATE_PREFIX = re.compile(r"^[a-zA-Z]{2}\s")
+
+
+def initialize_stations(txt_fn, json_fn):
     stationdict = {}
     with open(txt_fn, "r") as csvfile:
         stndata = csv.reader(csvfile, delimiter="\t")
         for row in stndata:
-            m = re.match(
-                r"(?P<stn_wmoid>^\w+)\s+(?P<stn_lat>\S+)\s+(?P<stn_lon>\S+)\s+(?P<stn_altitude>\S+)(?P<stn_name>\D+)",
-                row[0],
-            )
+            m = STATION_LINE.match(row[0])
             fields = m.groupdict()
             stn_wmoid = fields["stn_wmoid"][6:]
             stn_name = fields["stn_name"].strip()
 
-            if re.match(r"^[a-zA-Z]{2}\s", stn_name) and stn_name[:2] in US_STATES:
+            if US_STATE_PREFIX.match(stn_name) and stn_name[:2] in US_STATES:
                 stn_name = stn_name[2:].strip().title() + ", " + stn_name[:2]
             else:
                 stn_name = stn_name.title()
@@ -118,6 +140,7 @@ def initialize_stations(txt_fn, json_fn):
                     "elevation": stn_altitude,
                 }
         util.write_json_file(stationdict, json_fn)
+        stationutil.write_registry(stationdict, json_fn)
 
 
 def update_station_list(txt, jsn):
@@ -130,7 +153,7 @@ def update_station_list(txt, jsn):
     logging.debug(f"rebuilt {jsn} from {txt}")
 
 
-def walkt_tree(toplevel, directory, pattern, after):
+def walkt_tree(toplevel, directory, pattern, after, flights, missing, indices=False):
     nf = 0
     for p in sorted(directory.rglob(pattern)):
         s = p.stem
@@ -149,6 +172,8 @@ def walkt_tree(toplevel, directory, pattern, after):
         if toplevel.endswith("gisc/"):
             typus = "BUFR"
         entry = {"source": typus, "syn_timestamp": int(ts)}
+        if p.with_name(s + config.PREVIEW_SUFFIX).exists():
+            entry["preview"] = 1
         gj = None
         if stid not in station_list:
             # maybe mobile. Check ascent for type
@@ -159,6 +184,16 @@ def walkt_tree(toplevel, directory, pattern, after):
                 # WMO id syntax, but not in station_list
                 # hence an unregistered but fixed station
                 idtype = "unregistered"
+                if stid not in missing:
+                    # named by name_unregistered() once the walk is done
+                    gj = util.read_json_file(p, asGeojson=True, useBrotli=True)
+                    missing[stid] = {
+                        "name": stid,
+                        "lat": gj.properties["lat"],
+                        "lon": gj.properties["lon"],
+                        "elevation": gj.properties["elevation"],
+                    }
+                st = missing[stid]
             else:
                 # could be ship registration syntax. Check detail file.
                 gj = util.read_json_file(p, asGeojson=True, useBrotli=True)
@@ -167,11 +202,19 @@ def walkt_tree(toplevel, directory, pattern, after):
                 entry["lat"] = round(gj.properties["lat"], 6)
                 entry["lon"] = round(gj.properties["lon"], 6)
                 entry["elevation"] = round(gj.properties["elevation"], 2)
+                st = gj.properties
         else:
             # registered
             st = station_list[stid]
             idtype = "wmo"
 
+        if indices:
+            if gj is None:
+                gj = util.read_json_file(p, asGeojson=True, useBrotli=True)
+            for k in config.SUMMARY_INDICES:
+                if k in gj.properties:
+                    entry[k] = gj.properties[k]
+
         if stid not in flights:
             flights[stid] = Feature(
                 # FIXME add point after sorting for mobiles
@@ -184,49 +227,28 @@ def walkt_tree(toplevel, directory, pattern, after):
         f.properties["station_id"] = stid
         f.properties["id_type"] = idtype
         f.properties["name"] = stid
-
-        if stid in station_list:
-            st = station_list[stid]
+        if idtype == "wmo":
             # override name if we have one
             f.properties["name"] = st["name"]
-        else:
-            if idtype == "unregistered":
-                if stid not in missing:
-                    locations = rg.search((st["lat"], st["lon"]), verbose=False)
-                    if locations:
-                        print(
-                            stid,
-                            locations,
-                            st["lat"],
-                            st["lon"],
-                            st["elevation"],
-                            file=sys.stderr,
-                        )
-                        loc = locations[0]
-                        f.properties["name"] = loc["name"] + ", " + loc["cc"]
-                        s = f'{stid.rjust(11, "X")} {st["lat"]} {st["lon"]} {st["elevation"]} {f.properties["name"]} 2020'
-                        txtfrag.append(s)
-                    missing[stid] = {
-                        "name": f.properties["name"],
-                        "lat": st["lat"],
-                        "lon": st["lon"],
-                        "elevation": st["elevation"],
-                    }
         # this needs fixing up for mobiles after sorting
         f.geometry = Point(
             (round(st["lon"], 6), round(st["lat"], 6), round(st["elevation"], 1))
         )
         nf += 1
-    return (nf, 1, 1)
+    return nf
 
 
-def fixup_flights(flights):
+def fixup_flights(flights, merge=False):
     # pass 1: reverse sort ascents by timestamp
     for _stid, f in flights.items():
         a = f.properties["ascents"]
-        f.properties["ascents"] = sorted(
-            a, key=itemgetter("syn_timestamp"), reverse=True
-        )
+        if merge:
+            # also drops the lesser duplicates of an ascent
+            f.properties["ascents"] = StationAscents(a, merge).ascents
+        else:
+            f.properties["ascents"] = sorted(
+                a, key=itemgetter("syn_timestamp"), reverse=True
+            )
 
     # pass 2: for mobile stations, propagate up
     # coords of newest ascent to geometry.coords
@@ -242,6 +264,118 @@ def fixup_flights(flights):
             )
 
 
+def name_unregistered(flights, missing, cache, txtfrag):
+    """
+    name the unregistered stations in missing after the nearest place,
+    with a single batched reverse geocoder query for all of them, and
+    add a station_list.txt line for each to txtfrag
+    """
+    if not missing:
+        return
+    stids = sorted(missing)
+    locations = geocodeutil.reverse_geocode(
+        [(missing[stid]["lat"], missing[stid]["lon"]) for stid in stids], cache
+    )
+    for stid, loc in zip(stids, locations):
+        st = missing[stid]
+        st["name"] = loc["name"] + ", " + loc["cc"]
+        flights[stid].properties["name"] = st["name"]
+        # a registered station close by may be the same under a new id
+        near = station_list.nearest(st["lat"], st["lon"], max_km=config.NEARBY_KM)
+        print(
+            stid, loc, st["lat"], st["lon"], st["elevation"], near, file=sys.stderr
+        )
+        s = f'{stid.rjust(11, "X")} {st["lat"]} {st["lon"]} {st["elevation"]} {st["name"]} 2020'
+        txtfrag.append(s)
+
+
+def init_worker(json_fn):
+    # each worker maps the registry snapshot itself
+    global station_list
+    station_list = stationutil.load(json_fn)
+
+
+def scan_partition(dirs, block, after, indices=False, merge=False):
+    """
+    scan the detail files of one WMO block - the {cc} directory level -
+    below each of dirs. All ascents of a station live in one block, so
+    the partial summaries of different blocks need no merging.
+    return (flights, {station_id: unregistered station}, {dir: number of ascents})
+    """
+    flights = {}
+    missing = {}
+    counts = {}
+    for d in dirs:
+        directory = pathlib.Path(d) / block
+        counts[d] = 0
+        if directory.is_dir():
+            counts[d] = walkt_tree(
+                d, directory, "*.geojson.br", after, flights, missing, indices
+            )
+    fixup_flights(flights, merge)
+    return flights, missing, counts
+
+
+def scan_partitions(dirs, after, jobs, station_json, indices=False, merge=False):
+    """
+    yield the partial summaries of all WMO blocks below dirs, in order.
+    With jobs > 1 they are scanned in a process pool, with no more
+    than 2 * jobs partitions in flight or waiting to be consumed.
+    """
+    blocks = sorted(
+        {p.name for d in dirs for p in pathlib.Path(d).iterdir() if p.is_dir()}
+    )
+    if jobs <= 1:
+        for block in blocks:
+            with profiling.attribute(block):
+                yield scan_partition(dirs, block, after, indices, merge)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(station_json,)
+    ) as executor:
+        pending = deque()
+        todo = iter(blocks)
+        for block in islice(todo, 2 * jobs):
+            pending.append(
+                executor.submit(scan_partition, dirs, block, after, indices, merge)
+            )
+        while pending:
+            result = pending.popleft().result()
+            block = next(todo, None)
+            if block is not None:
+                pending.append(
+                    executor.submit(scan_partition, dirs, block, after, indices, merge)
+                )
+            yield result
+
+
+def publish(args, staging, compact, started, cutoff_ts):
+    """
+    replace the summary by the rebuilt one in staging. Ascents which
+    process.py added to the published summary while the rebuild ran
+    are merged in first. Call with the summary lock held.
+    """
+    late = []
+    if os.path.exists(args.summary):
+        published = util.read_json_file(args.summary, useBrotli=True, asGeojson=True)
+        # "processed" has a resolution of one second
+        late = late_ascents(published, started - 1)
+
+    if not late:
+        os.rename(staging, args.summary)
+        write_compact(compact.result(), args.summary, args.compact_codec)
+        return
+
+    fc = util.read_json_file(staging, useBrotli=True, asGeojson=True)
+    n = merge_late(fc, late, cutoff_ts, args.merge)
+    logging.debug(f"catch-up: merged {n} ascents of {len(late)} stations")
+    metrics.count("ascents_caught_up_total", n)
+    util.write_json_file(fc, args.summary, useBrotli=True, asGeojson=True)
+    write_compact_summary(fc, args.summary, args.compact_codec)
+    os.remove(staging)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="rebuild radiosonde summary.json",
@@ -262,12 +396,24 @@ def main():
         help="path to the source text file to generate the station_list.json",
     )
 
+    parser.add_argument(
+        "--geocode-cache",
+        action="store",
+        default=config.GEOCODE_CACHE,
+        help="path of the cache of reverse geocoded station names",
+    )
     parser.add_argument(
         "--summary",
         action="store",
         default=config.WWW_DIR + config.DATA_DIR + config.SUMMARY,
         help="path of brotli-compressed summary.geojson.br",
     )
+    parser.add_argument(
+        "--compact-codec",
+        choices=COMPACT_CODECS,
+        default="json",
+        help="encoding of the compact summary written next to --summary",
+    )
 
     parser.add_argument(
         "--dirs",
@@ -283,11 +429,62 @@ def main():
         default=config.MAX_DAYS_IN_SUMMARY,
         help="number of days of history to keep in summary",
     )
+    parser.add_argument(
+        "--jobs",
+        action="store",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes scanning WMO blocks",
+    )
+    parser.add_argument(
+        "--indices",
+        action="store_true",
+        default=False,
+        help="read every detail file to carry its convective indices "
+        "into the summary (slow)",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        default=False,
+        help="keep only the best source of an ascent reported by several, "
+        "as process.py --merge",
+    )
     parser.add_argument("--tmpdir", action="store", default=None)
+    parser.add_argument(
+        "--metrics",
+        action="store",
+        default=None,
+        help="write run metrics to this file: Prometheus textfile, or JSON if *.json",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=profiling.MODES,
+        default=None,
+        help="profile this run with cProfile or a stack sampler",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        action="store",
+        default=None,
+        help="where to keep per-run profiles (default: next to --metrics file, "
+        f"else {config.PROFILE_DIR})",
+    )
+    parser.add_argument(
+        "--profile-top",
+        action="store",
+        type=int,
+        default=config.PROFILE_TOP,
+        help="number of slowest input files to report",
+    )
 
     args = parser.parse_args()
     if args.tmpdir:
         config.tmpdir = args.tmpdir
+    if args.metrics:
+        metrics.enable()
+    if args.profile:
+        profiling.start("gensummary", args.profile)
     level = logging.WARNING
     if args.verbose:
         level = logging.DEBUG
@@ -305,35 +502,68 @@ def main():
             sys.exit(1)
 
     try:
-        with pidfile.Pidfile(config.LOCKFILE, log=logging.debug, warn=logging.debug):
-
-            cutoff_ts = util.now() - args.max_age * 24 * 3600
+        with pidfile.Pidfile(
+            config.REBUILD_LOCKFILE, log=logging.debug, warn=logging.debug
+        ):
+            # ingest keeps running meanwhile, see locks.py
+            started = util.now()
+            cutoff_ts = started - args.max_age * 24 * 3600
             update_station_list(args.station_text, args.station_json)
 
             global station_list
-            station_list = json.loads(util.read_file(args.station_json).decode())
-            ntotal = 0
-            for d in args.dirs:
-                nf, nu, nc = walkt_tree(d, pathlib.Path(d), "*.geojson.br", cutoff_ts)
-                ntotal = ntotal + nf
-
-            fixup_flights(flights)
-            fc = geojson.FeatureCollection([])
-            fc.properties = {
+            station_list = stationutil.load(args.station_json)
+            properties = {
                 "fmt": config.FORMAT_VERSION,
                 "generated": int(util.now()),
                 "max_age": config.MAX_DAYS_IN_SUMMARY * 24 * 3600,
             }
-            for _st, f in flights.items():
-                fc.features.append(f)
+            compact = CompactSummary(properties)
+            txtfrag = []
+            geocache = geocodeutil.load_cache(args.geocode_cache)
+
+            def features():
+                for flights, missing, counts in scan_partitions(
+                    args.dirs,
+                    cutoff_ts,
+                    args.jobs,
+                    args.station_json,
+                    args.indices,
+                    args.merge,
+                ):
+                    # one geocoder query per block, in this process only
+                    name_unregistered(flights, missing, geocache, txtfrag)
+                    for d, nf in counts.items():
+                        metrics.count("ascents_scanned_total", nf, dir=d)
+                    for f in flights.values():
+                        compact.add(f)
+                        yield f
+
+            # features are serialized as the partitions come in,
+            # into a staging file next to the summary
+            staging = args.summary + ".rebuild"
+            with metrics.timer("write_summary"):
+                util.write_feature_collection(
+                    features(), properties, staging, useBrotli=True
+                )
 
-            util.write_json_file(fc, args.summary, useBrotli=True, asGeojson=True)
+            with locks.lock("summary", timeout=config.SUMMARY_LOCK_TIMEOUT):
+                with metrics.timer("publish_summary"):
+                    publish(args, staging, compact, started, cutoff_ts)
 
+            geocodeutil.save_cache(geocache, args.geocode_cache)
             for l in txtfrag:
                 print(l, file=sys.stderr)
 
+            if args.metrics:
+                util.write_file(metrics.render(args.metrics), args.metrics)
+            if args.profile:
+                profiling.finish(args)
+
     except pidfile.ProcessRunningException:
-        logging.warning(f"the pid file {config.LOCKFILE}is in use, exiting.")
+        logging.warning(f"the pid file {config.REBUILD_LOCKFILE} is in use, exiting.")
+        return -1
+    except locks.LockHeld as e:
+        logging.error(f"{e}, rebuilt summary left in {args.summary}.rebuild")
         return -1
 
 
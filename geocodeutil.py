@@ -0,0 +1,57 @@
+"""
+reverse geocoding of unregistered stations
+
+the coordinates of all stations to be named are looked up in a single
+query against the reverse_geocoder KD-tree, and the results are kept
+in a JSON cache keyed by the coordinates rounded to
+config.GEOCODE_CACHE_DIGITS decimals, so a location is only ever
+looked up once.
+"""
+
+import logging
+import os
+
+import reverse_geocoder as rg
+
+import config
+
+import metrics
+
+import util
+
+
+def cache_key(lat, lon):
+    d = config.GEOCODE_CACHE_DIGITS
+    return f"{lat:.{d}f},{lon:.{d}f}"
+
+
+def load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    return util.read_json_file(path)
+
+
+def save_cache(cache, path):
+    util.write_json_file(cache, path)
+
+
+def reverse_geocode(coords, cache):
+    """
+    return the nearest place as {"name": ..., "cc": ...} for each
+    (lat, lon) in coords. Coordinates missing from cache are looked
+    up in one batch and added to it.
+    """
+    keys = [cache_key(lat, lon) for lat, lon in coords]
+    hits = sum(1 for k in keys if k in cache)
+    metrics.count("geocode_cache_hits_total", hits)
+    todo = sorted({k for k in keys if k not in cache})
+    if todo:
+        query = [tuple(float(x) for x in k.split(",")) for k in todo]
+        # mode 1: single process, the KD-tree is queried once for all
+        with metrics.timer("reverse_geocode"):
+            locations = rg.search(query, mode=1, verbose=False)
+        for k, loc in zip(todo, locations):
+            cache[k] = {"name": loc["name"], "cc": loc["cc"]}
+        logging.debug(f"reverse geocoded {len(todo)} locations")
+        metrics.count("geocode_lookups_total", len(todo))
+    return [cache[k] for k in keys]
@@ -1,14 +1,137 @@
 import logging
+import os
 import pathlib
 from datetime import datetime
+from functools import lru_cache
 from pprint import pprint
 
 import pytz
 
+import archiveutil
+
+import binaryutil
+
 import config
 
+import mergeutil
+
+import metrics
+
 import util
 
+
+@lru_cache(maxsize=config.DETAIL_PATH_CACHE_SIZE)
+def detail_path(source, station_id, syn_timestamp):
+    """
+    return the directory and file name stem of a detail file, relative
+    to destdir, as (f"{source}/{cc}/{subdir}/{year}/{month}",
+    f"{station_id}_{day}_{time}").
+    """
+    cc = station_id[:2]
+    subdir = station_id[2:5]
+
+    syn_time = datetime.utcfromtimestamp(syn_timestamp).replace(tzinfo=pytz.utc)
+    day = syn_time.strftime("%Y%m%d")
+    year = syn_time.strftime("%Y")
+    month = syn_time.strftime("%m")
+    time = syn_time.strftime("%H%M%S")
+
+    return f"{source}/{cc}/{subdir}/{year}/{month}", f"{station_id}_{day}_{time}"
+
+
+@lru_cache(maxsize=config.DIRECTORY_CACHE_SIZE)
+def ensure_dir(path):
+    """
+    create path including parents unless it is already known to exist.
+    Directories are assumed not to vanish while we run.
+    """
+    os.makedirs(path, exist_ok=True)
+
+
+def make_dirs(args, source, fcs):
+    """
+    pre-create the month directories of a batch of ascents
+    in one pass, before the detail files are written.
+    """
+    dirs = set()
+    for fc in fcs:
+        station_id = fc.properties["station_id"]
+        if args.station and args.station != station_id:
+            continue
+        reldir, _ = detail_path(source, station_id, fc.properties["syn_timestamp"])
+        dirs.add(f"{args.destdir}/{reldir}")
+    for d in sorted(dirs):
+        ensure_dir(d)
+    logging.debug(f"pre-created {len(dirs)} directories for {len(fcs)} ascents")
+
+
+def add_indices(fc, cols=None):
+    """
+    store the convective indices of an ascent in its properties,
+    cols are its binaryutil.columns() if already at hand
+    """
+    # needs numpy, which process.py must not import at startup
+    import thermoutil
+
+    if cols is None:
+        cols = binaryutil.columns(fc)
+    indices = thermoutil.convective_indices(
+        cols["temp"], cols["dewpoint"], cols["pressure"], cols["height"]
+    )
+    for k, v in indices.items():
+        d = config.INDEX_DECIMALS[k]
+        fc.properties[k] = round(float(v), d) if d else int(round(v))
+
+
+def resolve_duplicates(args, source, fc):
+    """
+    compare fc against the detail files of the same ascent in all
+    config.MERGE_SOURCES trees. Return False if one of them is as good
+    or better - on a tie the report written first stays - and fc is
+    dropped. Otherwise fc is going to replace them: their provenance
+    is added to its "merged_from", the files of the replaced ascent in
+    other trees are removed and its monthly archive record superseded.
+    """
+    station_id = fc.properties["station_id"]
+    syn_timestamp = fc.properties["syn_timestamp"]
+    quality = mergeutil.quality(fc)
+    replaced = []
+    for src in config.MERGE_SOURCES:
+        reldir, stem = detail_path(src, station_id, syn_timestamp)
+        path = f"{args.destdir}/{reldir}/{stem}.geojson.br"
+        if not os.path.exists(path):
+            continue
+        other = util.read_json_file(path, useBrotli=True, asGeojson=True)
+        if (
+            src == source
+            and other.properties.get("origin_member") == fc.properties["origin_member"]
+        ):
+            # the same report again, overwritten as without --merge
+            continue
+        if mergeutil.quality(other) >= quality:
+            logging.debug(f"{station_id} {syn_timestamp}: {path} stays, dropped")
+            metrics.count("duplicates_total", source=source, outcome="dropped")
+            return False
+        replaced.append((src, reldir, stem, other))
+
+    merged = []
+    for src, reldir, stem, other in replaced:
+        merged.append(mergeutil.provenance(other))
+        merged.extend(other.properties.get("merged_from", []))
+        if src != source:
+            # also the --binary and --chunked files next to it
+            for p in pathlib.Path(args.destdir, reldir).glob(f"{stem}.*"):
+                os.remove(p)
+            archive = archiveutil.archive_path(args.destdir, reldir, station_id)
+            if os.path.exists(archive):
+                archiveutil.supersede(archive, syn_timestamp)
+        logging.debug(f"{station_id} {syn_timestamp}: replacing {src}/{stem}")
+        metrics.count("duplicates_total", source=src, outcome="replaced")
+    if merged:
+        fc.properties["merged_from"] = merged
+    return True
+
+
 def write_geojson(args, source, fc, fn, archive, updated_stations):
     fc.properties["processed"] = int(datetime.utcnow().timestamp())
     fc.properties["origin_member"] = pathlib.PurePath(fn).name
@@ -17,41 +140,71 @@ def write_geojson(args, source, fc, fn, archive, updated_stations):
     station_id = fc.properties["station_id"]
 
     if args.station and args.station != station_id:
-        return
+        # filtered out, which is not a failure of the input file
+        return True
+
+    if args.merge:
+        with metrics.timer("resolve_duplicates"):
+            if not resolve_duplicates(args, source, fc):
+                return True
 
     fc.properties["fmt"] = config.FORMAT_VERSION
+    cols = binaryutil.columns(fc)
+    with metrics.timer("convective_indices"):
+        add_indices(fc, cols)
 
     logging.debug(
-        f"output samples retained: {len(fc.features)}, station id={station_id}"
+        "output samples retained: %d, station id=%s", len(fc.features), station_id
     )
 
-    updated_stations.append((station_id, fc.properties))
+    if args.preview:
+        # needs numpy, which process.py must not import at startup
+        import previewutil
 
-    cc = station_id[:2]
-    subdir = station_id[2:5]
+        with metrics.timer("preview"):
+            pv = previewutil.preview(fc, cols)
+        fc.properties["preview"] = 1
 
-    syn_time = datetime.utcfromtimestamp(fc.properties["syn_timestamp"]).replace(
-        tzinfo=pytz.utc
-    )
-    day = syn_time.strftime("%Y%m%d")
-    year = syn_time.strftime("%Y")
-    month = syn_time.strftime("%m")
-    time = syn_time.strftime("%H%M%S")
+    updated_stations.append((station_id, fc.properties))
 
-    dest = (
-        f"{args.destdir}/{source}/{cc}/{subdir}/"
-        f"{year}/{month}/{station_id}_{day}_{time}.geojson.br"
-    )
-    ref = f"{source}/{cc}/{subdir}/" f"{year}/{month}/{station_id}_{day}_{time}.geojson"
+    reldir, stem = detail_path(source, station_id, fc.properties["syn_timestamp"])
+    dest = f"{args.destdir}/{reldir}/{stem}.geojson.br"
+    ref = f"{reldir}/{stem}.geojson"
 
-    path = pathlib.Path(dest).parent.absolute()
-    pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+    ensure_dir(f"{args.destdir}/{reldir}")
 
     if not fc.is_valid:
         logging.error(f"--- invalid GeoJSON! {fc.errors()}")
         raise ValueError("invalid GeoJSON")
 
     util.write_json_file(fc, dest, useBrotli=True, asGeojson=True)
+    metrics.count("ascents_written_total", source=source)
+
+    if args.preview:
+        util.write_json_file(
+            pv,
+            f"{args.destdir}/{reldir}/{stem}{config.PREVIEW_SUFFIX}",
+            useBrotli=True,
+            asGeojson=True,
+        )
+        metrics.observe("ascent_levels", len(pv.features), feed="preview")
+
+    if args.binary:
+        b = binaryutil.encode(fc, args.binary)
+        util.write_file(
+            b,
+            f"{args.destdir}/{reldir}/{stem}{binaryutil.suffix(args.binary)}",
+            useBrotli=args.binary == "delta",
+            quality=config.BINARY_BROTLI_QUALITY,
+        )
+
+    if args.archive:
+        path = archiveutil.archive_path(args.destdir, reldir, station_id)
+        archiveutil.append(path, fc)
+
+    if args.chunked:
+        b = binaryutil.encode_chunked(fc, args.binary or "quantized")
+        util.write_file(b, f"{args.destdir}/{reldir}/{stem}{config.CHUNK_SUFFIX}")
 
     fc.properties["path"] = ref
 
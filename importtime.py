@@ -0,0 +1,109 @@
+"""
+check the startup import cost of process.py against a budget
+
+runs python -X importtime -c "import process" a few times, takes the
+fastest cumulative import time and fails if it exceeds the budget, or
+if any of the modules which must be loaded lazily (eccodes, netCDF4,
+scipy, ...) got imported at startup.
+
+example:
+    python importtime.py --budget 150 --top 10
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+
+import config
+
+
+def importtime(module):
+    """
+    import module in a fresh interpreter, return
+    {package: (self_us, cumulative_us)} and the
+    cumulative time of module itself in us
+    """
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages = {}
+    total = None
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header
+        name = fields[2].rstrip()
+        pkg = name.strip()
+        packages[pkg] = (int(fields[0]), int(fields[1]))
+        if name == f" {module}":
+            total = int(fields[1])
+    return packages, total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="check the startup import time budget",
+        add_help=True,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", default=False)
+    parser.add_argument("--module", action="store", default="process")
+    parser.add_argument(
+        "--budget",
+        action="store",
+        type=float,
+        default=config.IMPORT_TIME_BUDGET_MS,
+        help="maximum cumulative import time in ms",
+    )
+    parser.add_argument(
+        "--lazy",
+        nargs="*",
+        default=config.LAZY_IMPORTS,
+        help="modules which must not be imported at startup",
+    )
+    parser.add_argument("--repeat", action="store", type=int, default=5)
+    parser.add_argument(
+        "--top", action="store", type=int, default=0, help="list the N slowest imports"
+    )
+    args = parser.parse_args()
+
+    level = logging.WARNING
+    if args.verbose:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+
+    best = None
+    for _ in range(args.repeat):
+        packages, total = importtime(args.module)
+        logging.debug(f"import {args.module}: {total / 1000:.1f}ms")
+        if best is None or total < best[1]:
+            best = packages, total
+    packages, total = best
+
+    print(f"import {args.module}: {total / 1000:.1f}ms (budget {args.budget}ms)")
+    if args.top:
+        ranked = sorted(packages.items(), key=lambda kv: kv[1][0], reverse=True)
+        for name, (own, cumulative) in ranked[: args.top]:
+            print(f"{own / 1000:8.1f}ms {cumulative / 1000:8.1f}ms  {name}")
+
+    failed = False
+    if total / 1000 > args.budget:
+        logging.error(f"import {args.module} takes {total / 1000:.1f}ms")
+        failed = True
+    for name in args.lazy:
+        if name in packages:
+            logging.error(f"import {args.module} loads {name} at startup")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
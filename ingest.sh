@@ -12,6 +12,8 @@ REPO=/home/radiosonde/radiosonde-deploy
 TMPDIR=/tmp
 FLAGS=-v
 FLAGS=
+# to find slow input files, profile each run:
+# FLAGS="--profile cprofile --profile-dir /var/tmp/radiosonde-profiles"
 
 . /home/radiosonde/miniconda3/etc/profile.d/conda.sh
 conda activate radiosonde
@@ -0,0 +1,63 @@
+"""
+per-resource locks, shared between process.py, gensummary.py and compact.py
+
+    pidfile LOCKFILE          spool consumption and housekeeping (process.py)
+    pidfile REBUILD_LOCKFILE  one summary rebuild at a time (gensummary.py)
+    pidfile COMPACT_LOCKFILE  one archive compaction at a time (compact.py)
+    lock("details")           detail files and archives: held shared by
+                              ingest while writing, exclusively by
+                              compact.py while rebuilding an archive
+    lock("summary")           read-modify-write and publication of the
+                              summary files
+
+the named locks are flock(2) locks on files in config.LOCK_DIR, released
+by the kernel when the holder exits, however it exits.
+"""
+
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import config
+
+
+class LockHeld(Exception):
+    pass
+
+
+@contextmanager
+def lock(name, shared=False, timeout=None):
+    """
+    hold the named lock for the duration of the with-block. With a
+    timeout, raise LockHeld if it cannot be had within timeout seconds
+    (0: try once), else wait as long as it takes.
+    """
+    os.makedirs(config.LOCK_DIR, exist_ok=True)
+    path = os.path.join(config.LOCK_DIR, f"{name}.lock")
+    op = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        start = time.monotonic()
+        if timeout is None:
+            fcntl.flock(fd, op)
+        else:
+            while True:
+                try:
+                    fcntl.flock(fd, op | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() - start >= timeout:
+                        raise LockHeld(f"{path} is held by another process")
+                    time.sleep(config.LOCK_POLL_INTERVAL)
+        logging.debug(
+            "locked %s%s after %.3fs",
+            path,
+            " (shared)" if shared else "",
+            time.monotonic() - start,
+        )
+        yield
+    finally:
+        # closing the descriptor releases the lock
+        os.close(fd)
@@ -0,0 +1,61 @@
+"""
+pick the best of several reports of the same ascent
+
+the same synoptic ascent may come in as a GISC zip member, a GISC Tokyo
+.bufr file and in a MADIS netCDF file. With --merge, process.py keeps
+a single detail file per station and syn_timestamp, the best by
+quality():
+
+    1. the reporting format, config.MERGE_RANK: BUFR beats netCDF,
+       whose positions are always simulated
+    2. a real track beats one without any horizontal displacement
+    3. more levels beat fewer
+
+on a tie, the report written first stays, so the outcome does not
+depend on which of two equal reports is processed last.
+the detail file records the reports it replaced in "merged_from", one
+provenance() entry each. The summary keeps one ascent per syn_timestamp
+by format rank alone, which agrees with the above as the format comes
+first (see summaryutil.StationAscents).
+"""
+
+import config
+
+
+def rank(source):
+    """
+    the summary-level rank of a reporting format, "BUFR" or "netCDF"
+    """
+    return config.MERGE_RANK.get(source, -1)
+
+
+def drifts(fc):
+    """
+    True if the ascent has a reported track which actually moves
+    """
+    if fc.properties.get("path_source") == "simulated" or not fc.features:
+        return False
+    lon, lat = fc.features[0].geometry["coordinates"][:2]
+    return any(
+        f.geometry["coordinates"][0] != lon or f.geometry["coordinates"][1] != lat
+        for f in fc.features
+    )
+
+
+def quality(fc):
+    """
+    sort key of an ascent FeatureCollection, the best report is the largest
+    """
+    return (rank(fc.properties.get("source")), drifts(fc), len(fc.features))
+
+
+def provenance(fc):
+    """
+    the record of a replaced report kept in the "merged_from" property
+    """
+    p = fc.properties
+    entry = {"source": p.get("source"), "levels": len(fc.features)}
+    for k in ("path_source", "origin_member", "origin_archive", "processed"):
+        if k in p:
+            entry[k] = p[k]
+    return entry
@@ -0,0 +1,205 @@
+"""
+per-run stage timers, counters and histograms
+
+collection is off unless enable() was called; while disabled every
+entry point returns after a single global check, and timer() hands out
+a shared no-op context manager.
+
+at the end of a run, render() formats everything as a Prometheus
+textfile (for node_exporter's textfile collector), or as JSON if the
+destination file name ends in .json.
+"""
+
+import json
+import time
+from bisect import bisect_left
+
+import config
+
+_enabled = False
+_started = 0.0
+
+_counters = {}  # (name, labels) -> value
+_gauges = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+
+# upper bounds, +Inf is implicit
+BUCKETS = {
+    "stage_seconds": [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300],
+    "compression_ratio": [0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0],
+    "ascent_levels": [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000],
+}
+
+HELP = {
+    "stage_seconds": "wall time spent per pipeline stage",
+    "compression_ratio": "compressed/uncompressed size of written files",
+    "ascent_levels": "levels per emitted ascent",
+    "files_total": "input files processed, by feed and outcome",
+    "messages_decoded_total": "BUFR messages decoded",
+    "samples_used_total": "BUFR samples used",
+    "samples_dropped_total": "samples dropped, by reason",
+    "fixups_total": "BUFR values faked or replaced, by key",
+    "ascents_written_total": "detail files written",
+    "ascents_skipped_total": "ascents not emitted, by reason",
+    "ascents_scanned_total": "detail files scanned by gensummary",
+    "bytes_uncompressed_total": "bytes before compression",
+    "bytes_written_total": "bytes written to disk",
+    "run_timestamp_seconds": "start of the run",
+    "run_duration_seconds": "duration of the run",
+}
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, e, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, stage, labels):
+        self.labels = dict(labels, stage=stage)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, t, e, tb):
+        observe("stage_seconds", time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def enable():
+    global _enabled, _started
+    _enabled = True
+    _started = time.time()
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
+
+
+def enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    _counters[k] = _counters.get(k, 0) + value
+
+
+def gauge(name, value, **labels):
+    if not _enabled:
+        return
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    h = _histograms.get(k)
+    if h is None:
+        h = _histograms[k] = [[0] * (len(BUCKETS[name]) + 1), 0.0, 0]
+    h[0][bisect_left(BUCKETS[name], value)] += 1
+    h[1] += value
+    h[2] += 1
+
+
+def timer(stage, **labels):
+    """
+    time a with-block into the stage_seconds histogram:
+        with metrics.timer("bufr_decode", feed="gisc"):
+            ...
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(stage, labels)
+
+
+def _escape(v):
+    """
+    a label value as the text exposition format wants it
+    """
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labelstr(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def as_prometheus():
+    prefix = config.METRICS_PREFIX
+    lines = []
+    seen = set()
+
+    def header(name, typ):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {prefix}_{name} {HELP[name]}")
+            lines.append(f"# TYPE {prefix}_{name} {typ}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        header(name, "counter")
+        lines.append(f"{prefix}_{name}{_labelstr(labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{prefix}_{name}{_labelstr(labels)} {value}")
+    for (name, labels), (buckets, total, n) in sorted(_histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for le, c in zip(BUCKETS[name] + ["+Inf"], buckets):
+            cumulative += c
+            lines.append(
+                f"{prefix}_{name}_bucket{_labelstr(labels, [('le', le)])} {cumulative}"
+            )
+        lines.append(f"{prefix}_{name}_sum{_labelstr(labels)} {total}")
+        lines.append(f"{prefix}_{name}_count{_labelstr(labels)} {n}")
+    return "\n".join(lines) + "\n"
+
+
+def as_dict():
+    def flat(d):
+        return [{"name": n, "labels": dict(l), "value": v} for (n, l), v in d.items()]
+
+    return {
+        "counters": flat(_counters),
+        "gauges": flat(_gauges),
+        "histograms": [
+            {
+                "name": n,
+                "labels": dict(l),
+                "buckets": dict(zip([str(b) for b in BUCKETS[n]] + ["+Inf"], b)),
+                "sum": total,
+                "count": c,
+            }
+            for (n, l), (b, total, c) in _histograms.items()
+        ],
+    }
+
+
+def render(name):
+    """
+    return the collected metrics as bytes, formatted
+    for the destination file name
+    """
+    gauge("run_timestamp_seconds", int(_started))
+    gauge("run_duration_seconds", round(time.time() - _started, 3))
+    if name.endswith(".json"):
+        s = json.dumps(as_dict(), indent=config.INDENT)
+    else:
+        s = as_prometheus()
+    return s.encode(config.CHARSET)
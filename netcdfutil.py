@@ -1,14 +1,16 @@
 import gzip
 import logging
-from datetime import datetime, timedelta
-from math import cos, isinf, isnan, pi
+from datetime import datetime
+from math import isnan
 
-from config import ASCENT_RATE
+from constants import earth_avg_radius
 
-from constants import earth_avg_radius, earth_gravity, mperdeg
+from driftutil import ascent_times, drift
 
 import geojson
 
+import metrics
+
 from netCDF4 import Dataset
 
 import numpy as np
@@ -17,7 +19,7 @@ import pytz
 
 from scipy.interpolate import interp1d
 
-from thermodynamics import barometric_equation_inv
+from thermoutil import hypsometric_heights
 
 # ASCENT_RATE = 5  # m/s = 300m/min
 # earth_gravity = 9.80665
@@ -198,26 +200,17 @@ def RemNaN_and_Interp(raob, file):
     )
 
 
-# very simplistic
-
-
-def height2time(h0, height):
-    hdiff = height - h0
-    return hdiff / ASCENT_RATE
-
-
-def latlonPlusDisplacement(lat=0, lon=0, u=0, v=0):
-    # HeidiWare
-    dLat = v / mperdeg
-    dLon = u / (cos((lat + dLat / 2) / 180 * pi) * mperdeg)
-    return lat + dLat, lon + dLon
+def height_to_geopotential_height(height):
+    return height * earth_avg_radius / (earth_avg_radius + height)
 
 
-def height_to_geopotential_height(height):
-    return earth_gravity / ((1 / height) + 1 / earth_avg_radius) / earth_gravity
+def geopotential_height_to_height(gph):
+    return gph * earth_avg_radius / (earth_avg_radius - gph)
 
 
-def emit_ascents(args, source, file, archive, raob, stations):
+def emit_ascents(args, source, file, archive, raob, stations, profiles=None):
+    if profiles is None:
+        profiles = RemNaN_and_Interp(raob, file)
     (
         relTime,
         sondTyp,
@@ -231,7 +224,7 @@ def emit_ascents(args, source, file, archive, raob, stations):
         V,
         wmo_ids,
         times,
-    ) = RemNaN_and_Interp(raob, file)
+    ) = profiles
 
     results = []
 
@@ -251,10 +244,10 @@ def emit_ascents(args, source, file, archive, raob, stations):
 
         if isnan(staLat[i]) or isnan(staLon[i]) or isnan(staElev[i]):
             logging.error(f"skipping station {stn} - no location")
+            metrics.count("ascents_skipped_total", reason="no location")
             continue
 
         # print(i, stn)
-        takeoff = datetime.utcfromtimestamp(relTime[i]).replace(tzinfo=pytz.utc)
         syntime = times[i]
         properties = {
             "station_id": stn,
@@ -271,51 +264,44 @@ def emit_ascents(args, source, file, archive, raob, stations):
         fc = geojson.FeatureCollection([])
         fc.properties = properties
 
-        lat_t = staLat[i]
-        lon_t = staLon[i]
-
-        t0 = T[i][0]
-        p0 = P[i][0]
         h0 = staElev[i]
 
-        prevSecsIntoFlight = 0
+        # hypsometric equation, layer by layer from the station elevation
+        gpheights = hypsometric_heights(
+            height_to_geopotential_height(h0), T[i], Td[i], P[i]
+        )
+        heights = np.round(geopotential_height_to_height(gpheights), 1)
 
         logging.debug(f"station {stn}: samples={len(P[i])}")
-        for n in range(0, len(P[i])):
-            pn = P[i][n]
-
-            if isinf(T[i][n]) or isinf(Td[i][n]) or isinf(P[i][n]):
-                logging.debug(
-                    f"station {stn}: skipping layer  P={P[i][n]}  T={T[i][n]} Td={Td[i][n]}"
-                )
-                continue
+        keep = ~(np.isinf(T[i]) | np.isinf(Td[i]) | np.isinf(P[i]))
+        for n in np.flatnonzero(~keep):
+            logging.debug(
+                f"station {stn}: skipping layer  P={P[i][n]}  T={T[i][n]} Td={Td[i][n]}"
+            )
+            metrics.count("samples_dropped_total", reason="inf")
 
-            # gross haque to determine rough time of sample
-            height = round(barometric_equation_inv(h0, t0, p0, pn), 1)
-            secsIntoFlight = height2time(h0, height)
-            delta = timedelta(seconds=secsIntoFlight)
-            sampleTime = takeoff + delta
+        # rough time of sample, and the drift up to it
+        secs = np.where(keep, ascent_times(heights - h0), np.nan)
+        lats, lons = drift(staLat[i], staLon[i], secs, U[i], V[i])
+        sampletimes = relTime[i] + np.round(secs, 6)
 
+        for n in np.flatnonzero(keep):
             properties = {
-                "time": sampleTime.timestamp(),
-                "gpheight": round(height_to_geopotential_height(height), 1),
+                "time": float(sampletimes[n]),
+                "gpheight": round(float(gpheights[n]), 1),
                 "temp": round(T[i][n], 2),
                 "dewpoint": round(Td[i][n], 2),
                 "pressure": P[i][n],
             }
             u = U[i][n]
             v = V[i][n]
-            du = dv = 0
             if u > -9999.0 and v > -9999.0:
                 properties["wind_u"] = round(u, 2)
                 properties["wind_v"] = round(v, 2)
-                dt = secsIntoFlight - prevSecsIntoFlight
-                du = u * dt
-                dv = v * dt
-                lat_t, lon_t = latlonPlusDisplacement(lat=lat_t, lon=lon_t, u=du, v=dv)
-                prevSecsIntoFlight = secsIntoFlight
             f = geojson.Feature(
-                geometry=geojson.Point((float(lon_t), float(lat_t), round(height, 2))),
+                geometry=geojson.Point(
+                    (float(lons[n]), float(lats[n]), round(float(heights[n]), 2))
+                ),
                 properties=properties,
             )
             if not f.is_valid:
@@ -323,19 +309,25 @@ def emit_ascents(args, source, file, archive, raob, stations):
                 return False, None
 
             fc.features.append(f)
-        fc.properties["lastSeen"] = sampleTime.timestamp()
+        fc.properties["lastSeen"] = (
+            fc.features[-1].properties["time"] if fc.features else float(relTime[i])
+        )
+        metrics.observe("ascent_levels", len(fc.features), feed="madis")
         results.append((fc, file, archive))
     return True, results
 
 
-def process_netcdf(args, source, file, archive, stationdict):
-
+def read_netcdf(file):
+    """
+    read a gzipped MADIS netCDF file into the raob dict
+    consumed by emit_ascents. Returns None if unreadable.
+    """
     with gzip.open(file, "rb") as f:
         try:
             nc = Dataset("inmemory.nc", memory=f.read())
         except Exception as e:
             logging.error(f"exception {e} reading {f} as netCDF")
-            return False, None
+            return None
 
         relTime = nc.variables["relTime"][:].filled(fill_value=np.nan)
         sondTyp = nc.variables["sondTyp"][:].filled(fill_value=np.nan)
@@ -355,7 +347,7 @@ def process_netcdf(args, source, file, archive, stationdict):
 
         Wspeed = nc.variables["wsMan"][:].filled(fill_value=np.nan)
         Wdir = nc.variables["wdMan"][:].filled(fill_value=np.nan)
-        raob = {
+        return {
             "relTime": relTime,
             "sondTyp": sondTyp,
             "staLat": staLat,
@@ -375,4 +367,14 @@ def process_netcdf(args, source, file, archive, stationdict):
             ],
             "wmo_ids": [str(ident).zfill(5) for ident in wmo_ids],
         }
-        return emit_ascents(args, source, file, archive, raob, stationdict)
+
+
+def process_netcdf(args, source, file, archive, stationdict):
+    with metrics.timer("read_netcdf"):
+        raob = read_netcdf(file)
+    if raob is None:
+        return False, None
+    with metrics.timer("RemNaN_and_Interp"):
+        profiles = RemNaN_and_Interp(raob, file)
+    with metrics.timer("emit_ascents"):
+        return emit_ascents(args, source, file, archive, raob, stationdict, profiles)
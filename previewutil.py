@@ -0,0 +1,39 @@
+"""
+coarse previews of ascents, for thumbnails and map tracks
+
+preview() decimates an ascent with thinutil.thin() over -ln p:
+a level is dropped when linear interpolation between the levels kept
+around it reproduces temperature, dewpoint, wind and track within
+config.PREVIEW_TOLERANCE - all of them at once. The first and last
+levels and the mandatory levels (config.PREVIEW_KEEP_HPA) are always
+kept, so that a preview is plotted like a TEMP message.
+
+process.py --preview writes it next to the detail file, see
+"Preview files" in README.md.
+"""
+
+import geojson
+
+import numpy as np
+
+import binaryutil
+
+import config
+
+from thinutil import thin
+
+
+def preview(fc, cols=None):
+    """
+    the preview FeatureCollection of an ascent, sharing its features;
+    cols are its binaryutil.columns() if already at hand
+    """
+    if cols is None:
+        cols = binaryutil.columns(fc)
+    pressure = np.array(cols["pressure"])
+    keep = np.isin(np.round(pressure, 2), config.PREVIEW_KEEP_HPA)
+    idx = thin(pressure, cols["height"], cols, config.PREVIEW_TOLERANCE, keep)
+    pv = geojson.FeatureCollection([fc.features[i] for i in idx])
+    pv.properties = dict(fc.properties)
+    pv.properties["levels"] = len(fc.features)
+    return pv
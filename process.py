@@ -1,6 +1,6 @@
 import argparse
 import gzip
-import json
+import importlib
 import logging
 import os
 import pathlib
@@ -9,29 +9,77 @@ import sys
 import tempfile
 import time
 import zipfile
-from operator import itemgetter
 
-import geojson
+import binaryutil
 
-from geojsonutil import write_geojson
+from geojsonutil import make_dirs, write_geojson
 
-from bufrutil import convert_bufr_to_geojson, process_bufr
+import locks
 
-from netcdfutil import process_netcdf
+import metrics
 
 import pidfile
 
+import profiling
+
+import spoolutil
+
+import stationutil
+
+from summaryutil import (
+    COMPACT_CODECS,
+    StationAscents,
+    group_by_station,
+    write_compact_summary,
+)
+
 import config
 
 import util
 
+# feed label for metrics, by input file extension
+FEEDS = {".zip": "gisc", ".bin": "gisc-tokyo", ".bufr": "gisc-tokyo", ".gz": "madis"}
+
+# process_file() result for an input file which could not be read:
+# not recorded in the spool state, the next run tries again
+RETRY = "retry"
+
+# decoder backends by input file extension. These pull in eccodes,
+# netCDF4, scipy and numpy, so they are imported only once a file
+# needing them turns up - housekeeping-only runs never load them.
+# see importtime.py for the startup budget.
+BACKENDS = {
+    ".zip": "bufrutil",
+    ".bin": "bufrutil",
+    ".bufr": "bufrutil",
+    ".gz": "netcdfutil",
+}
+
+
+def backend(ext):
+    return importlib.import_module(BACKENDS[ext])
+
+
+def load_backends(flist):
+    """
+    import the decoder backends for the file extensions in flist
+    """
+    exts = {os.path.splitext(f)[1] for f in flist}
+    for name in sorted({BACKENDS[e] for e in exts if e in BACKENDS}):
+        with metrics.timer("import", module=name):
+            importlib.import_module(name)
+        logging.debug(f"loaded backend {name}")
+
 
 def gen_output(args, source, h, fn, archive, updated_stations):
-    fc = convert_bufr_to_geojson(args, h)
-    return write_geojson(args, source, fc, fn, archive, updated_stations)
+    with metrics.timer("convert_bufr_to_geojson"):
+        fc = backend(".bufr").convert_bufr_to_geojson(args, h)
+    with metrics.timer("write_geojson"):
+        return write_geojson(args, source, fc, fn, archive, updated_stations)
 
 
 def update_geojson_summary(args, stations, updated_stations, summary):
+    import geojson
 
     stations_with_ascents = {}
     # unroll into dicts for quick access
@@ -45,67 +93,19 @@ def update_geojson_summary(args, stations, updated_stations, summary):
     # remove entries from ascents which have a syn_timestamp less than cutoff_ts
     cutoff_ts = util.now() - args.max_age * 24 * 3600
 
-    # now walk the updates
-    for station, asc in updated_stations:
-        if station in stations_with_ascents:
-
-            # we already have ascents from this station.
-            # append, sort by synoptic time and de-duplicate
-            oldlist = stations_with_ascents[station]["properties"]["ascents"]
-            oldlist.append(asc)
-
-            pruned = [x for x in oldlist if x["syn_timestamp"] > cutoff_ts]
-
-            logging.debug(f"pruning {station}: {len(oldlist)} -> {len(pruned)}")
-
-            newlist = sorted(pruned, key=itemgetter("syn_timestamp"), reverse=True)
-            # https://stackoverflow.com/questions/9427163/remove-duplicate-dict-in-list-in-python
-            seen = set()
-            dedup = []
-            for d in newlist:
-                # keep an ascent of each source, even if same synop time
-                t = str(d["syn_timestamp"]) + d["source"]
-                if t not in seen:
-                    seen.add(t)
-                    dedup.append(d)
-            stations_with_ascents[station]["properties"]["ascents"] = dedup
-
-            # fixup the name if it was added to station_list.json:
-            ident = stations_with_ascents[station]["properties"]["name"]
-            if ident in stations:
-                # using WMO id as name. Probably mobile. Replace by string name.
-                stations_with_ascents[station]["properties"]["name"] = stations[ident][
-                    "name"
-                ]
-
-            # overwrite the station coords by the coords of the last ascent
-            # to properly handle mobile stations
-            if asc["id_type"] == "mobile":
-                logging.debug(
-                    f"fix coords {station} -> {asc['lon']} {asc['lat']} {asc['elevation']}"
-                )
-                properties = stations_with_ascents[station]["properties"]
-                stations_with_ascents[station] = geojson.Feature(
-                    geometry=geojson.Point(
-                        (
-                            round(asc["lon"], 6),
-                            round(asc["lat"], 6),
-                            round(asc["elevation"], 1),
-                        )
-                    ),
-                    properties=properties,
-                )
-
-        else:
+    # now walk the updates, station by station
+    for station, ascents in group_by_station(updated_stations).items():
+        if station not in stations_with_ascents:
             # station appears with first-time ascent
+            asc = ascents[0]
             properties = {}
-            properties["ascents"] = [asc]
+            properties["ascents"] = []
+            properties["station_id"] = station
 
             if station in stations:
                 st = stations[station]
                 coords = (st["lon"], st["lat"], st["elevation"])
                 properties["name"] = st["name"]
-                properties["station_id"] = station
                 properties["id_type"] = "wmo"
             else:
 
@@ -126,6 +126,49 @@ def update_geojson_summary(args, stations, updated_stations, summary):
                 geometry=geojson.Point(coords), properties=properties
             )
 
+        # merge into the ascents we already have from this station:
+        # insert by synoptic time, de-duplicate, drop expired ones
+        properties = stations_with_ascents[station]["properties"]
+        store = StationAscents(properties["ascents"], args.merge)
+        n = len(store)
+        for asc in ascents:
+            store.insert(asc)
+        expired = store.prune(cutoff_ts)
+        logging.debug(
+            "merging %s: %d + %d updates -> %d, %d expired",
+            station,
+            n,
+            len(ascents),
+            len(store),
+            expired,
+        )
+        properties["ascents"] = store.ascents
+
+        # fixup the name if it was added to station_list.json:
+        ident = properties["name"]
+        if ident in stations:
+            # using WMO id as name. Probably mobile. Replace by string name.
+            properties["name"] = stations[ident]["name"]
+
+        # overwrite the station coords by the coords of the last ascent
+        # to properly handle mobile stations
+        mobile = [asc for asc in ascents if asc["id_type"] == "mobile"]
+        if mobile:
+            asc = mobile[-1]
+            logging.debug(
+                f"fix coords {station} -> {asc['lon']} {asc['lat']} {asc['elevation']}"
+            )
+            stations_with_ascents[station] = geojson.Feature(
+                geometry=geojson.Point(
+                    (
+                        round(asc["lon"], 6),
+                        round(asc["lat"], 6),
+                        round(asc["elevation"], 1),
+                    )
+                ),
+                properties=properties,
+            )
+
     # create GeoJSON summary
     ns = na = 0
     fc = geojson.FeatureCollection([])
@@ -135,6 +178,8 @@ def update_geojson_summary(args, stations, updated_stations, summary):
         "max_age": args.max_age * 24 * 3600,
     }
     for _st, f in stations_with_ascents.items():
+        if not f.properties["ascents"]:
+            continue
         sid, stype = slimdown(f)
         f.properties["station_id"] = sid
         f.properties["id_type"] = stype
@@ -146,6 +191,7 @@ def update_geojson_summary(args, stations, updated_stations, summary):
 
     useBrotli = args.summary.endswith(".br")
     util.write_json_file(fc, args.summary, useBrotli=useBrotli, asGeojson=True)
+    write_compact_summary(fc, args.summary, args.compact_codec)
 
 
 def slimdown(st):
@@ -160,6 +206,7 @@ def slimdown(st):
         a.pop("path_source", None)
         a.pop("origin_member", None)
         a.pop("origin_archive", None)
+        a.pop("merged_from", None)
         a.pop("firstSeen", None)
         a.pop("lastSeen", None)
         a.pop("fmt", None)
@@ -174,6 +221,9 @@ def slimdown(st):
         a.pop("sonde_measure", None)
         a.pop("sonde_swversion", None)
         a.pop("sonde_frequency", None)
+        for k in config.INDEX_DECIMALS:
+            if k not in config.SUMMARY_INDICES:
+                a.pop(k, None)
 
         if st.properties["id_type"] == "wmo":
             # fixed station. Take coords from geometry.coords.
@@ -187,224 +237,271 @@ def slimdown(st):
     return result
 
 
-def newer(filename, ext):
+def process_files(args, state, flist, station_dict, updated_stations):
     """
-    given a file like foo.ext and an extension like .json,
-    return True if:
-        foo.json does not exist or
-        foo.json has an older modification time than foo.ext
+    process the files of flist, marking them running in the spool state
+    unless state is None. Return [(file, success, duration), ...] for
+    SpoolState.finish() once the summary is updated.
     """
-    (fn, e) = os.path.splitext(filename)
-    target = fn + ext
-    if not os.path.exists(target):
-        return True
-    return os.path.getmtime(filename) > os.path.getmtime(target)
-
-
-def process_files(args, flist, station_dict, updated_stations):
-
+    outcomes = []
     for f in flist:
-        if not args.ignore_timestamps and not newer(f, config.TS_PROCESSED):
-            logging.debug(f"skipping: {f}  (processed)")
-            continue
-
         (fn, ext) = os.path.splitext(f)
         logging.debug(f"processing: {f} fn={fn} ext={ext}")
 
-        if ext == ".zip":  # a zip archive of BUFR files
-            try:
-                with zipfile.ZipFile(f) as zf:
-                    source = "gisc"
-                    zip_success = True
-                    for info in zf.infolist():
-                        try:
-                            data = zf.read(info.filename)
-                            fd, path = tempfile.mkstemp(dir=config.tmpdir)
-                            os.write(fd, data)
-                            os.lseek(fd, 0, os.SEEK_SET)
-                            file = os.fdopen(fd)
-                        except KeyError:
-                            logging.error(
-                                f"zip file {f}: no such member {info.filename}"
-                            )
-                            continue
-                        else:
-                            logging.debug(
-                                f"processing BUFR: {f} member {info.filename} size={len(data)}"
-                            )
-                            success, d = process_bufr(
+        if state is not None:
+            state.start(f)
+        feed = FEEDS.get(ext, ext)
+        t0 = time.monotonic()
+        with metrics.timer("process_file", feed=feed), profiling.attribute(f):
+            success = process_file(args, f, fn, ext, station_dict, updated_stations)
+        if success == RETRY:
+            if state is not None:
+                state.forget(f)
+            outcome = RETRY
+        else:
+            outcomes.append((f, success, time.monotonic() - t0))
+            outcome = "processed" if success else "failed"
+        metrics.count("files_total", feed=feed, outcome=outcome)
+    return outcomes
+
+
+def process_file(args, f, fn, ext, station_dict, updated_stations):
+    """
+    process a single input file, return True if successful, RETRY if
+    it could not be read and should be tried again
+    """
+    if ext == ".zip":  # a zip archive of BUFR files
+        try:
+            with zipfile.ZipFile(f) as zf:
+                source = "gisc"
+                zip_success = True
+                for info in zf.infolist():
+                    try:
+                        data = zf.read(info.filename)
+                        fd, path = tempfile.mkstemp(dir=config.tmpdir)
+                        os.write(fd, data)
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        file = os.fdopen(fd)
+                    except KeyError:
+                        logging.error(
+                            f"zip file {f}: no such member {info.filename}"
+                        )
+                        continue
+                    else:
+                        logging.debug(
+                            f"processing BUFR: {f} member {info.filename} size={len(data)}"
+                        )
+                        with profiling.attribute(f"{f}:{info.filename}"):
+                            success, d = backend(ext).process_bufr(
                                 args, source, file, info.filename, f
                             )
                             if success:
                                 success = gen_output(
                                     args, source, d, info.filename, f, updated_stations
                                 )
-                            zip_success = zip_success and success
-                            file.close()
-                            os.remove(path)
-                    if not args.ignore_timestamps:
-                        gen_timestamp(fn, zip_success)
-
-            except zipfile.BadZipFile as e:
-                logging.error(f"{f}: {e}")
-                if not args.ignore_timestamps:
-                    gen_timestamp(fn, False)
-
-        elif (ext == ".bin") or (ext == ".bufr"):  # a singlle BUFR file
-            source = "gisc"
-            file = open(f, "rb")
-            logging.debug(f"processing BUFR: {f}")
-            success, d = process_bufr(args, source, file, f, None)
-            if success:
-                success = gen_output(args, source, d, fn, None, updated_stations)
+                        zip_success = zip_success and success
+                        file.close()
+                        os.remove(path)
+                return zip_success
+
+        except zipfile.BadZipFile as e:
+            logging.error(f"{f}: {e}")
+            return False
+
+    elif (ext == ".bin") or (ext == ".bufr"):  # a singlle BUFR file
+        source = "gisc"
+        file = open(f, "rb")
+        logging.debug(f"processing BUFR: {f}")
+        success, d = backend(ext).process_bufr(args, source, file, f, None)
+        if success:
+            success = gen_output(args, source, d, fn, None, updated_stations)
+
+        file.close()
+        return success
+
+    elif ext == ".gz":  # a gzipped netCDF file
+        source = "madis"
+        logging.debug(f"processing netCDF: {f}")
+        try:
+            success, results = backend(ext).process_netcdf(
+                args, source, f, None, station_dict
+            )
 
-            file.close()
-            if not args.ignore_timestamps:
-                gen_timestamp(fn, success)
+            if success:
+                make_dirs(args, source, [fc for fc, _file, _archive in results])
+                for fc, file, archive in results:
+                    with metrics.timer("write_geojson"):
+                        write_geojson(
+                            args, source, fc, file, archive, updated_stations
+                        )
 
-        elif ext == ".gz":  # a gzipped netCDF file
-            source = "madis"
-            logging.debug(f"processing netCDF: {f}")
-            try:
-                success, results = process_netcdf(args, source, f, None, station_dict)
+        except gzip.BadGzipFile as e:
+            logging.error(f"{f}: {e}")
+            return False
 
-                if success:
-                    for fc, file, archive in results:
-                        write_geojson(args, source, fc, file, archive, updated_stations)
+        except OSError as e:
+            logging.error(f"{f}: {e}")
+            return RETRY
 
-            except gzip.BadGzipFile as e:
-                logging.error(f"{f}: {e}")
-                if not args.ignore_timestamps:
-                    gen_timestamp(fn, False)
+        else:
+            return success
+    return False
 
-            except OSError as e:
-                logging.error(f"{f}: {e}")
 
-            else:
-                if not args.ignore_timestamps:
-                    gen_timestamp(fn, success)
+# the logging is ridiculous.
+def spool_moves(state, spooldir, ext, keeptime, now):
+    """
+    the input files in spooldir + INCOMING which are done with: failed
+    ones, processed ones older than keeptime secs, and those marked
+    complete by a .timestamp file. One directory scan and one query.
+    Return [(src, dst), ...] for the input files and their sidecars.
+    """
+    incoming = spooldir + config.INCOMING
+    try:
+        with os.scandir(incoming) as it:
+            entries = {e.name: e for e in it}
+    except FileNotFoundError:
+        return []
+    done = state.done_in(incoming)
+
+    moves = []
+    for name in entries:
+        if not name.endswith(ext) or name.startswith("."):
+            continue
+        stem = name[: -len(ext)]
+        status, finished = done.get(name, (None, None))
+        if status == spoolutil.FAILED:
+            dest = spooldir + config.FAILED
+        elif status == spoolutil.PROCESSED:
+            if keeptime and now - finished <= keeptime:
+                continue
+            dest = spooldir + config.PROCESSED
+        elif stem + config.TS_TIMESTAMP in entries:
+            dest = spooldir + config.PROCESSED
+        else:
+            continue
+        moves.append((os.path.join(incoming, name), os.path.join(dest, name)))
+        for tsext in (config.TS_TIMESTAMP, config.TS_PROCESSED, config.TS_FAILED):
+            ts = entries.get(stem + tsext)
+            if ts is not None:
+                moves.append((ts.path, os.path.join(dest, ts.name)))
+    return moves
 
 
-def gen_timestamp(fn, success):
-    if success:
-        pathlib.Path(fn + config.TS_PROCESSED).touch(mode=0o777, exist_ok=True)
+def move_files(moves, simulate=True, trace=False):
+    """
+    carry out the renames of spool_moves(), creating the destinations
+    """
+    for d in sorted({os.path.dirname(dst) for _src, dst in moves}):
+        if not os.path.isdir(d):
+            if simulate:
+                logging.debug(f"creating dir: {d}")
+            else:
+                os.makedirs(d, mode=0o755, exist_ok=True)
+    for src, dst in moves:
+        if simulate:
+            logging.debug(f"time to move: {src} --> {dst}")
+            continue
+        if trace:
+            logging.debug(f"moving: {src} --> {dst}")
+        os.rename(src, dst)
+
+
+def keep_house(args, state):
+    now = time.time()
+    spools = [
+        (config.SPOOLDIR_MADIS, ".gz", args.keep_time),
+        (config.SPOOLDIR_GISC, ".zip", 0),
+        (config.SPOOLDIR_GISC_TOKYO, ".bufr", 0),
+    ]
+    for spooldir, ext, keeptime in spools:
+        moves = spool_moves(state, spooldir, ext, keeptime, now)
+        move_files(moves, simulate=args.sim_housekeep, trace=args.verbose)
+        if not args.sim_housekeep:
+            state.moved(moves, now)
+            moved = sum(1 for src, _dst in moves if src.endswith(ext))
+            metrics.count("spool_files_moved_total", moved, spool=spooldir)
+    if not args.sim_housekeep:
+        pruned = state.prune(now)
+        if pruned:
+            logging.debug(f"dropped {pruned} spool state entries")
+
+
+def ingest(args):
+    """
+    convert the input files, update the summary and keep house
+    """
+    if args.only_args:
+        flist = args.files
     else:
-        pathlib.Path(fn + config.TS_FAILED).touch(mode=0o777, exist_ok=True)
+        l = list(pathlib.Path(config.SPOOLDIR_GISC + config.INCOMING).glob("*.zip"))
+        l.extend(
+            list(
+                pathlib.Path(config.SPOOLDIR_GISC_TOKYO + config.INCOMING).glob(
+                    "*.bufr"
+                )
+            )
+        )
+        l.extend(
+            list(pathlib.Path(config.SPOOLDIR_MADIS + config.INCOMING).glob("*.gz"))
+        )
+        flist = [str(f) for f in l]
+
+    # housekeeping needs the spool state even with -n. A dry run
+    # works on a copy in memory
+    state = None
+    if not (args.ignore_timestamps and args.only_args):
+        state = spoolutil.SpoolState(
+            args.spool_db, simulate=args.sim_housekeep or args.list_pending
+        )
+    if args.ignore_timestamps:
+        tracked = None
+    else:
+        tracked = state
+        with metrics.timer("spool_pending"):
+            flist = state.pending(flist)
+        metrics.gauge("spool_pending_files", len(flist))
+    if args.list_pending:
+        for f in flist:
+            print(f)
+        return 0
+
+    # work the backlog
+    updated_stations = []
+    outcomes = []
+    if not args.sim_housekeep and flist:
+        station_dict = stationutil.load(args.stations)
+
+        load_backends(flist)
+        # a summary rebuild may run meanwhile, see locks.py
+        with locks.lock("details", shared=True):
+            outcomes = process_files(
+                args, tracked, flist, station_dict, updated_stations
+            )
 
+    if not args.sim_housekeep and updated_stations:
+        logging.debug(f"creating GeoJSON summary: {args.summary}")
+        with locks.lock("summary", timeout=config.SUMMARY_LOCK_TIMEOUT):
+            # read under the lock, gensummary.py may have
+            # published a rebuilt summary since we started
+            useBrotli = args.summary.endswith(".br")
+            summary = util.read_json_file(
+                args.summary, useBrotli=useBrotli, asGeojson=True
+            )
+            with metrics.timer("update_geojson_summary"):
+                update_geojson_summary(args, station_dict, updated_stations, summary)
 
-# the logging is ridiculous.
-def move_files(
-    directory, pattern, tsextension, destdir, keeptime=0, simulate=True, trace=False
-):
-    destpath = pathlib.Path(destdir)
-    if not destpath.exists():
-        if simulate:
-            logging.debug(f"creating dir: {destpath}")
-        else:
-            destpath.mkdir(mode=0o755, parents=True, exist_ok=False)
-    spooldir = pathlib.Path(directory)
-    # if trace:
-    #     logging.debug(f"spooldir={spooldir} pattern={pattern} tsextension={tsextension}")
-    for path in spooldir.glob(pattern):
-        # if trace:
-        #     logging.debug(f"lookat: {path}")
-        tspath = path.parent / pathlib.Path(path.stem + tsextension)
-        # if trace:
-        #     logging.debug(f"tspath: {tspath}")
-        if tspath.exists():
-            tssec = tspath.stat().st_mtime
-            age = time.time() - tssec
-            # if trace:
-            #     logging.debug(f"tspath exists, age={age}: {tspath}")
-            if age > keeptime:
-                dpath = destpath / path.name
-                dtspath = destpath / tspath.name
-                if simulate:
-                    logging.debug(f"time to move: {path} --> {dpath}")
-                    logging.debug(f"time to move: {tspath} --> {dtspath}")
-                else:
-                    if trace:
-                        logging.debug(f"moving: {path} --> {dpath}")
-                    path.rename(dpath)
-                    if trace:
-                        logging.debug(f"moving: {tspath} --> {dtspath}")
-                    tspath.rename(dtspath)
-
-
-def keep_house(args):
-    move_files(
-        config.SPOOLDIR_MADIS + config.INCOMING,
-        "*.gz",
-        config.TS_PROCESSED,
-        config.SPOOLDIR_MADIS + config.PROCESSED,
-        keeptime=args.keep_time,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
-    move_files(
-        config.SPOOLDIR_MADIS + config.INCOMING,
-        "*.gz",
-        config.TS_FAILED,
-        config.SPOOLDIR_MADIS + config.FAILED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
+    # only once the summary has the ascents: when its lock is held,
+    # LockHeld leaves the files "running" and the next run redoes them
+    if tracked is not None:
+        for f, success, duration in outcomes:
+            tracked.finish(f, success, duration)
 
-    move_files(
-        config.SPOOLDIR_GISC + config.INCOMING,
-        "*.zip",
-        config.TS_FAILED,
-        config.SPOOLDIR_GISC + config.FAILED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
-    move_files(
-        config.SPOOLDIR_GISC + config.INCOMING,
-        "*.zip",
-        config.TS_TIMESTAMP,
-        config.SPOOLDIR_GISC + config.PROCESSED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
-    move_files(
-        config.SPOOLDIR_GISC + config.INCOMING,
-        "*.zip",
-        config.TS_PROCESSED,
-        config.SPOOLDIR_GISC + config.PROCESSED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
-    move_files(
-        config.SPOOLDIR_GISC_TOKYO + config.INCOMING,
-        "*.bufr",
-        config.TS_FAILED,
-        config.SPOOLDIR_GISC_TOKYO + config.FAILED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
-    move_files(
-        config.SPOOLDIR_GISC_TOKYO + config.INCOMING,
-        "*.bufr",
-        config.TS_TIMESTAMP,
-        config.SPOOLDIR_GISC_TOKYO + config.PROCESSED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
-    move_files(
-        config.SPOOLDIR_GISC_TOKYO + config.INCOMING,
-        "*.bufr",
-        config.TS_PROCESSED,
-        config.SPOOLDIR_GISC + config.PROCESSED,
-        keeptime=0,
-        trace=args.verbose,
-        simulate=args.sim_housekeep,
-    )
+    if not args.only_args:
+        logging.debug("running housekeeping")
+        with metrics.timer("keep_house"):
+            keep_house(args, state)
+    return 0
 
 
 def main():
@@ -417,7 +514,16 @@ def main():
         action="store",
         type=int,
         default=100,
-        help="generate output only if samples vary vertically more than hstep",
+        help="with --thinning hstep, generate output only if samples vary "
+        "vertically more than hstep",
+    )
+    parser.add_argument(
+        "--thinning",
+        choices=["adaptive", "hstep"],
+        default="hstep",
+        help="BUFR sample thinning: keep the levels needed to interpolate "
+        "temperature, dewpoint, wind and track within THIN_TOLERANCE, "
+        "or one level every hstep metres",
     )
     parser.add_argument("--destdir", action="store", default=".")
     parser.add_argument(
@@ -428,6 +534,38 @@ def main():
     )
     parser.add_argument("--geojson", action="store_true", default=False)
     parser.add_argument("--dump-geojson", action="store_true", default=False)
+    parser.add_argument(
+        "--binary",
+        choices=binaryutil.CODECS,
+        default=None,
+        help="also write binary columnar detail files (*.bin) with this codec",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        default=False,
+        help="also append each ascent to its per-station monthly archive",
+    )
+    parser.add_argument(
+        "--chunked",
+        action="store_true",
+        default=False,
+        help="also write detail files split into pressure bands (*.chunks.bin), "
+        "with the --binary codec (default: quantized)",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        default=False,
+        help="also write a decimated preview of each ascent "
+        f"(*{config.PREVIEW_SUFFIX}), flagged in the summary",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        default=False,
+        help="keep only the best report of an ascent delivered by several feeds",
+    )
     parser.add_argument(
         "--sim-housekeep",
         action="store_true",
@@ -436,11 +574,30 @@ def main():
     )
     parser.add_argument("--only-args", action="store_true", default=False)
     parser.add_argument("--summary", action="store", required=True)
+    parser.add_argument(
+        "--compact-codec",
+        choices=COMPACT_CODECS,
+        default="json",
+        help="encoding of the compact summary written next to --summary",
+    )
     parser.add_argument(
         "-n",
         "--ignore-timestamps",
         action="store_true",
-        help="ignore, and do not create timestamps",
+        help="process every input file and record nothing in the spool state; "
+        "housekeeping still reads it unless --only-args",
+    )
+    parser.add_argument(
+        "--spool-db",
+        action="store",
+        default=config.SPOOL_STATE_DB,
+        help="spool state database, see spoolutil.py",
+    )
+    parser.add_argument(
+        "--list-pending",
+        action="store_true",
+        default=False,
+        help="print the input files which still need processing, and exit",
     )
     parser.add_argument(
         "--stations",
@@ -454,7 +611,7 @@ def main():
         action="store",
         type=int,
         default=config.MAX_DAYS_IN_SUMMARY,
-        help="number of days of history to keep in summary",
+        help="number of days of history to keep in summary, also for new stations",
     )
     parser.add_argument(
         "--keep-time",
@@ -463,11 +620,41 @@ def main():
         default=config.KEEP_MADIS_PROCESSED_FILES,
         help="time in secs to retain processed .gz files in MADIS incoming spooldir",
     )
+    parser.add_argument(
+        "--metrics",
+        action="store",
+        default=None,
+        help="write run metrics to this file: Prometheus textfile, or JSON if *.json",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=profiling.MODES,
+        default=None,
+        help="profile this run with cProfile or a stack sampler",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        action="store",
+        default=None,
+        help="where to keep per-run profiles (default: next to --metrics file, "
+        f"else {config.PROFILE_DIR})",
+    )
+    parser.add_argument(
+        "--profile-top",
+        action="store",
+        type=int,
+        default=config.PROFILE_TOP,
+        help="number of slowest input files to report",
+    )
     parser.add_argument("files", nargs="*")
 
     args = parser.parse_args()
     if args.tmpdir:
         config.tmpdir = args.tmpdir
+    if args.metrics:
+        metrics.enable()
+    if args.profile:
+        profiling.start("process", args.profile)
 
     level = logging.WARNING
     if args.verbose:
@@ -479,52 +666,20 @@ def main():
     try:
         with pidfile.Pidfile(config.LOCKFILE, log=logging.debug, warn=logging.debug):
 
-            station_dict = json.loads(util.read_file(args.stations).decode())
-            updated_stations = []
-
-            useBrotli = args.summary.endswith(".br")
-            summary = util.read_json_file(
-                args.summary, useBrotli=useBrotli, asGeojson=True
-            )
-
-            if args.only_args:
-                flist = args.files
-            else:
-                l = list(
-                    pathlib.Path(config.SPOOLDIR_GISC + config.INCOMING).glob("*.zip")
-                )
-                l.extend(
-                    list(
-                        pathlib.Path(config.SPOOLDIR_GISC_TOKYO + config.INCOMING).glob(
-                            "*.bufr"
-                        )
-                    )
-                )
-                l.extend(
-                    list(
-                        pathlib.Path(config.SPOOLDIR_MADIS + config.INCOMING).glob(
-                            "*.gz"
-                        )
-                    )
-                )
-                flist = [str(f) for f in l]
-
-            # work the backlog
-            if not args.sim_housekeep:
-                process_files(args, flist, station_dict, updated_stations)
-
-            if not args.sim_housekeep and updated_stations:
-                logging.debug(f"creating GeoJSON summary: {args.summary}")
-                update_geojson_summary(args, station_dict, updated_stations, summary)
-
-            if not args.only_args:
-                logging.debug("running housekeeping")
-                keep_house(args)
-            return 0
+            try:
+                return ingest(args)
+            finally:
+                if args.metrics:
+                    util.write_file(metrics.render(args.metrics), args.metrics)
+                if args.profile:
+                    profiling.finish(args)
 
     except pidfile.ProcessRunningException:
         logging.warning(f"the pid file {config.LOCKFILE} is in use, exiting.")
         return -1
+    except locks.LockHeld as e:
+        logging.error(f"{e}, summary not updated")
+        return -1
 
 
 if __name__ == "__main__":
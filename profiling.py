@@ -0,0 +1,214 @@
+"""
+per-run profiling for process.py and gensummary.py
+
+start(mode) profiles the rest of the run with cProfile or a simple
+stack sampler. Wrapping the work for each input file in
+attribute(name) records its wall time, and in sampling mode the
+samples taken meanwhile are rooted under that file name. An
+attribute() within another one - a zip member - is recorded in a
+table of its own, so no time is counted twice.
+
+save() writes the profile, the per-file and per-member timing tables
+and a "slowest N input files" report into a new run directory under
+the profile directory, and removes the oldest run directories beyond
+config.PROFILE_KEEP_RUNS.
+"""
+
+import cProfile
+import logging
+import os
+import pathlib
+import pstats
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+
+import config
+
+MODES = ["cprofile", "sampling"]
+
+_NULL = nullcontext()
+
+_profiler = None
+
+
+class _Sampler(threading.Thread):
+    """
+    sample the main thread's stack every interval seconds,
+    count collapsed stacks (flamegraph.pl / speedscope format)
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.target = threading.get_ident()
+        self.stacks = Counter()
+        self.current = None
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if self.current:
+                stack.append(f"file:{self.current}")
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+class _Profiler:
+    def __init__(self, prog, mode, interval):
+        self.prog = prog
+        self.mode = mode
+        self.started = datetime.utcnow()
+        self.files = []  # (seconds, name)
+        self.members = []  # (seconds, name) of nested attributions
+        self.depth = 0
+        if mode == "cprofile":
+            self.engine = cProfile.Profile()
+            self.engine.enable()
+        else:
+            self.engine = _Sampler(interval)
+            self.engine.start()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self.engine.disable()
+        else:
+            self.engine.stop()
+
+
+class _Attribution:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.nested = self.profiler.depth > 0
+        self.profiler.depth += 1
+        if self.profiler.mode == "sampling":
+            self.previous = self.profiler.engine.current
+            self.profiler.engine.current = self.name
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, t, e, tb):
+        table = self.profiler.members if self.nested else self.profiler.files
+        table.append((time.perf_counter() - self.start, self.name))
+        self.profiler.depth -= 1
+        if self.profiler.mode == "sampling":
+            self.profiler.engine.current = self.previous
+        return False
+
+
+def start(prog, mode, interval=config.PROFILE_SAMPLE_INTERVAL):
+    global _profiler
+    if mode not in MODES:
+        raise ValueError(f"unknown profiling mode {mode}, use one of {MODES}")
+    _profiler = _Profiler(prog, mode, interval)
+
+
+def attribute(name):
+    """
+    attribute the time spent in a with-block to the input file name.
+    a no-op unless profiling was started.
+    """
+    if _profiler is None:
+        return _NULL
+    return _Attribution(_profiler, name)
+
+
+def slowest(n):
+    if _profiler is None:
+        return []
+    return sorted(_profiler.files, reverse=True)[:n]
+
+
+def rotate(profile_dir, keep):
+    runs = sorted(p for p in pathlib.Path(profile_dir).iterdir() if p.is_dir())
+    for p in runs[: max(len(runs) - keep, 0)]:
+        logging.debug(f"removing old profile {p}")
+        shutil.rmtree(p, ignore_errors=True)
+
+
+def save(profile_dir, top=10, keep=config.PROFILE_KEEP_RUNS):
+    """
+    stop profiling, write the results into a fresh run directory
+    below profile_dir and return its path
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    p = _profiler
+    p.stop()
+    _profiler = None
+
+    rundir = pathlib.Path(profile_dir) / (
+        f"{p.started.strftime('%Y%m%d-%H%M%S')}-{p.prog}-{os.getpid()}"
+    )
+    rundir.mkdir(parents=True, exist_ok=True)
+
+    if p.mode == "cprofile":
+        p.engine.dump_stats(str(rundir / "profile.pstats"))
+        with open(rundir / "profile.txt", "w") as f:
+            st = pstats.Stats(p.engine, stream=f)
+            st.sort_stats("cumulative").print_stats(50)
+    else:
+        with open(rundir / "stacks.txt", "w") as f:
+            for stack, n in p.engine.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+    ranked = sorted(p.files, reverse=True)
+    tables = [("files.tsv", ranked)]
+    if p.members:
+        tables.append(("members.tsv", sorted(p.members, reverse=True)))
+    for fn, table in tables:
+        with open(rundir / fn, "w") as f:
+            f.write("seconds\tfile\n")
+            for secs, name in table:
+                f.write(f"{secs:.4f}\t{name}\n")
+    with open(rundir / "slowest.txt", "w") as f:
+        f.write(report(ranked[:top]))
+
+    rotate(profile_dir, keep)
+    return rundir
+
+
+def finish(args):
+    """
+    save the profile of a run started with --profile, next to the
+    --metrics file unless --profile-dir was given, and log the
+    slowest input files
+    """
+    profile_dir = args.profile_dir
+    if not profile_dir:
+        if args.metrics:
+            profile_dir = os.path.join(os.path.dirname(args.metrics), "profiles")
+        else:
+            profile_dir = config.PROFILE_DIR
+    ranked = slowest(args.profile_top)
+    rundir = save(profile_dir, top=args.profile_top)
+    logging.debug(f"profile written to {rundir}")
+    logging.debug(report(ranked).rstrip("\n"))
+
+
+def report(ranked):
+    lines = [f"slowest {len(ranked)} input files:"]
+    for secs, name in ranked:
+        lines.append(f"{secs:9.3f}s  {name}")
+    return "\n".join(lines) + "\n"
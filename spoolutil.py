@@ -0,0 +1,259 @@
+"""
+the spool state database: what became of each input file
+
+process.py records every input file it works on in a SQLite table
+(WAL journal, so readers never block the ingest):
+
+    path        absolute path, the key; updated when housekeeping moves it
+    size        st_size when processing started
+    mtime       st_mtime when processing started
+    hash        BLAKE2b of the content, once processed
+    status      "running", "processed" or "failed"
+    started     unix time processing started
+    duration    seconds it took
+    moved       unix time housekeeping moved it out of incoming
+
+pending() stats each candidate once and looks all of them up in bulk.
+A file is done if its row is processed or failed with the same size and
+mtime - or the same size and hash, so a file which was merely touched
+is not converted again. A "running" row means a run died on that file
+or could not update the summary, it is retried. Files next to a
+.processed or .failed sidecar of the former scheme are taken over as
+done on first sight. A hash computed by pending() is reused by finish()
+unless the file changed meanwhile.
+
+With simulate, for --sim-housekeep and --list-pending, the table is
+an in-memory copy of the database: pending() and housekeeping see the
+sidecars taken over as usual, but nothing is written back.
+
+Rows of files moved out of incoming are dropped after
+config.SPOOL_STATE_RETENTION seconds.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL,
+    moved REAL
+);
+CREATE INDEX IF NOT EXISTS files_moved ON files(moved);
+"""
+
+RUNNING = "running"
+PROCESSED = "processed"
+FAILED = "failed"
+DONE = (PROCESSED, FAILED)
+
+# host parameters per "IN (...)" query, below SQLite's limit
+_BATCH = 500
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _legacy_status(path, st):
+    """
+    (status, time) a sidecar of the former scheme records for path, or None
+    """
+    stem = os.path.splitext(path)[0]
+    for tsext, status in ((config.TS_PROCESSED, PROCESSED), (config.TS_FAILED, FAILED)):
+        try:
+            ts = os.stat(stem + tsext).st_mtime
+        except FileNotFoundError:
+            continue
+        if ts >= st.st_mtime:
+            return status, ts
+    return None
+
+
+class SpoolState:
+    """
+    the spool state table of one database file
+    """
+
+    def __init__(self, path, simulate=False):
+        self.path = path
+        self._hashes = {}  # path: (size, mtime, hash) computed by pending()
+        if simulate:
+            self.db = sqlite3.connect(":memory:")
+            if os.path.exists(path):
+                disk = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                disk.backup(self.db)
+                disk.close()
+            self.db.executescript(SCHEMA)
+            return
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=config.SUMMARY_LOCK_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def rows(self, paths):
+        """
+        {path: (size, mtime, hash, status)} of those paths which have a row
+        """
+        result = {}
+        for i in range(0, len(paths), _BATCH):
+            batch = paths[i : i + _BATCH]
+            marks = ",".join("?" * len(batch))
+            for path, *row in self.db.execute(
+                "SELECT path, size, mtime, hash, status FROM files "
+                f"WHERE path IN ({marks})",
+                batch,
+            ):
+                result[path] = tuple(row)
+        return result
+
+    def pending(self, flist):
+        """
+        the files of flist which still need processing, in flist order
+        """
+        paths = [os.path.abspath(f) for f in flist]
+        known = self.rows(paths)
+        result = []
+        adopted = []
+        for f, path in zip(flist, paths):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            row = known.get(path)
+            if row is None:
+                legacy = _legacy_status(path, st)
+                if legacy is None:
+                    result.append(f)
+                else:
+                    adopted.append((path, st.st_size, st.st_mtime) + legacy)
+                continue
+            size, mtime, digest, status = row
+            if status == RUNNING:
+                logging.warning(f"{f}: not finished by an earlier run, retrying")
+                result.append(f)
+            elif size != st.st_size:
+                result.append(f)
+            elif mtime == st.st_mtime:
+                logging.debug(f"skipping: {f}  ({status})")
+            elif digest is None:
+                result.append(f)
+            else:
+                current = file_hash(path)
+                if current == digest:
+                    logging.debug(f"skipping: {f}  ({status}, touched)")
+                    with self.db:
+                        self.db.execute(
+                            "UPDATE files SET mtime = ? WHERE path = ?",
+                            (st.st_mtime, path),
+                        )
+                else:
+                    self._hashes[path] = (st.st_size, st.st_mtime, current)
+                    result.append(f)
+        if adopted:
+            logging.debug(f"taking over {len(adopted)} sidecar timestamps")
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO files "
+                    "(path, size, mtime, status, started) VALUES (?, ?, ?, ?, ?)",
+                    adopted,
+                )
+        return result
+
+    def start(self, f):
+        """
+        record that processing f begins, committed before any output exists;
+        finish() follows once the summary has its ascents
+        """
+        path = os.path.abspath(f)
+        st = os.stat(path)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, status, started) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime, RUNNING, time.time()),
+            )
+
+    def finish(self, f, success, duration):
+        path = os.path.abspath(f)
+        st = os.stat(path)
+        size, mtime, digest = self._hashes.pop(path, (None, None, None))
+        if (size, mtime) != (st.st_size, st.st_mtime):
+            digest = file_hash(path)
+        with self.db:
+            self.db.execute(
+                "UPDATE files SET status = ?, hash = ?, duration = ? WHERE path = ?",
+                (PROCESSED if success else FAILED, digest, duration, path),
+            )
+
+    def forget(self, f):
+        """
+        drop the row of f, so it is pending again in the next run
+        """
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(f),))
+
+    def done_in(self, directory):
+        """
+        {file name: (status, finish time)} of the processed and failed
+        files directly in directory
+        """
+        prefix = os.path.join(os.path.abspath(directory), "")
+        result = {}
+        # the range of paths starting with prefix, "0" follows "/"
+        for path, status, started, duration in self.db.execute(
+            "SELECT path, status, started, duration FROM files "
+            "WHERE path >= ? AND path < ? AND status IN (?, ?)",
+            (prefix, prefix[:-1] + "0") + DONE,
+        ):
+            name = path[len(prefix) :]
+            if "/" not in name:
+                result[name] = (status, started + (duration or 0.0))
+        return result
+
+    def moved(self, moves, now=None):
+        """
+        follow the renames (src, dst) of housekeeping
+        """
+        now = now or time.time()
+        with self.db:
+            self.db.executemany(
+                "UPDATE OR REPLACE files SET path = ?, moved = ? WHERE path = ?",
+                [
+                    (os.path.abspath(dst), now, os.path.abspath(src))
+                    for src, dst in moves
+                ],
+            )
+
+    def prune(self, now=None):
+        """
+        drop the rows of files moved away long enough ago
+        """
+        now = now or time.time()
+        with self.db:
+            cur = self.db.execute(
+                "DELETE FROM files WHERE moved < ?",
+                (now - config.SPOOL_STATE_RETENTION,),
+            )
+        return cur.rowcount
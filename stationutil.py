@@ -0,0 +1,204 @@
+"""
+the station registry: station_list.json as a binary snapshot
+
+next to station_list.json, gensummary.py writes station_list.registry.bin:
+
+    header      magic "RSST", u8 version, 3 bytes 0, u32 stations,
+                u32 length of ids, u32 length of names, 4 bytes 0
+    coords      per station f8 lat, f8 lon, f8 elevation
+    ids         the station ids, UTF-8, separated by newlines
+    names       the station names, likewise, in the same order
+
+load() maps the snapshot instead of parsing the JSON, rewriting it first
+if station_list.json is newer. The registry looks up an id in O(1) and
+returns the same {"name", "lat", "lon", "elevation"} dicts as the JSON,
+so it can be used wherever a station dict was. nearest() finds the
+closest station with a one-degree grid index built on first use.
+"""
+
+import array
+import logging
+import mmap
+import os
+import struct
+import sys
+from math import asin, cos, floor, radians, sin, sqrt
+
+import config
+
+from constants import earth_avg_radius
+
+import util
+
+MAGIC = b"RSST"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sB3xIII4x")
+
+_KM_PER_RAD = earth_avg_radius / 1000.0
+
+
+def registry_path(json_fn):
+    """
+    the snapshot belonging to a station_list.json
+    """
+    return os.path.splitext(json_fn)[0] + config.REGISTRY_SUFFIX
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """
+    great-circle distance, haversine formula
+    """
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = (
+        sin(dlat / 2) ** 2
+        + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    )
+    return 2 * _KM_PER_RAD * asin(min(1.0, sqrt(a)))
+
+
+def encode(stations):
+    """
+    the snapshot of a {station_id: {"name", "lat", "lon", "elevation"}} dict
+    """
+    ids = sorted(stations)
+    coords = array.array("d")
+    for stid in ids:
+        st = stations[stid]
+        coords.extend((st["lat"], st["lon"], st["elevation"]))
+    if sys.byteorder == "big":
+        coords.byteswap()
+    idb = "\n".join(ids).encode(config.CHARSET)
+    names = "\n".join(stations[stid]["name"] for stid in ids).encode(config.CHARSET)
+    header = _HEADER.pack(MAGIC, VERSION, len(ids), len(idb), len(names))
+    return header + coords.tobytes() + idb + names
+
+
+def write_registry(stations, json_fn):
+    path = registry_path(json_fn)
+    util.write_file(encode(stations), path)
+    logging.debug(f"wrote {path}: {len(stations)} stations")
+    return path
+
+
+class StationRegistry:
+    """
+    read-only mapping station_id -> {"name", "lat", "lon", "elevation"}
+    over a snapshot, plus nearest-station queries
+    """
+
+    def __init__(self, b):
+        magic, version, n, idlen, namelen = _HEADER.unpack_from(b, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a version {VERSION} station registry")
+        pos = _HEADER.size
+        mv = memoryview(b)
+        coords = mv[pos : pos + 24 * n]
+        if sys.byteorder == "big":
+            a = array.array("d", coords.tobytes())
+            a.byteswap()
+            coords = memoryview(a)
+        self._coords = coords.cast("d") if coords.format != "d" else coords
+        pos += 24 * n
+        ids = bytes(mv[pos : pos + idlen]).decode(config.CHARSET)
+        self._ids = ids.split("\n") if n else []
+        self._index = {stid: i for i, stid in enumerate(self._ids)}
+        pos += idlen
+        # decoded on first use, most lookups are by id only
+        self._namebytes = mv[pos : pos + namelen]
+        self._names = None
+        self._grid = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, stid):
+        return stid in self._index
+
+    def __getitem__(self, stid):
+        return self._station(self._index[stid])
+
+    def get(self, stid, default=None):
+        i = self._index.get(stid)
+        return default if i is None else self._station(i)
+
+    def names(self):
+        if self._names is None:
+            names = bytes(self._namebytes).decode(config.CHARSET)
+            self._names = names.split("\n") if self._ids else []
+        return self._names
+
+    def _station(self, i):
+        c = self._coords
+        return {
+            "name": self.names()[i],
+            "lat": c[3 * i],
+            "lon": c[3 * i + 1],
+            "elevation": c[3 * i + 2],
+        }
+
+    def _cells(self):
+        if self._grid is None:
+            grid = {}
+            c = self._coords
+            for i in range(len(self._ids)):
+                cell = (floor(c[3 * i]), floor(c[3 * i + 1]))
+                grid.setdefault(cell, []).append(i)
+            self._grid = grid
+        return self._grid
+
+    def nearest(self, lat, lon, max_km=None):
+        """
+        return (station_id, distance in km) of the station closest to
+        lat, lon, or None if there is none within max_km
+        """
+        grid = self._cells()
+        c = self._coords
+        clat, clon = floor(lat), floor(lon)
+        best, best_km = None, float("inf")
+        for k in range(181):
+            # the cells at Chebyshev distance k from the query's cell
+            for dlat in range(-k, k + 1):
+                row = clat + dlat
+                if row < -90 or row > 90:
+                    continue
+                step = 1 if abs(dlat) == k else 2 * k
+                for dlon in range(-k, k + 1, max(step, 1)):
+                    cell = (row, (clon + dlon + 180) % 360 - 180)
+                    for i in grid.get(cell, ()):
+                        d = distance_km(lat, lon, c[3 * i], c[3 * i + 1])
+                        if d < best_km:
+                            best, best_km = i, d
+            # anything in ring k + 1 is at least k degrees away in
+            # latitude, or k degrees in longitude at the most
+            # poleward latitude that ring reaches
+            poleward = radians(min(90.0, abs(lat) + k + 1))
+            bound = _KM_PER_RAD * min(
+                radians(k), 2 * asin(min(1.0, cos(poleward) * sin(radians(k) / 2)))
+            )
+            if best_km <= bound or (max_km is not None and bound > max_km):
+                break
+        if best is None or (max_km is not None and best_km > max_km):
+            return None
+        return self._ids[best], best_km
+
+
+def load(json_fn):
+    """
+    the StationRegistry of a station_list.json, via its snapshot
+    """
+    path = registry_path(json_fn)
+    if util.age(path) < util.age(json_fn):
+        stations = util.read_json_file(json_fn)
+        try:
+            write_registry(stations, json_fn)
+        except OSError as e:
+            logging.warning(f"cannot write {path}: {e}")
+            return StationRegistry(encode(stations))
+    with open(path, "rb") as f:
+        b = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return StationRegistry(b)
@@ -0,0 +1,377 @@
+"""
+incremental merge of new ascents into the summary
+
+per station, the ascents are kept sorted newest first, so a batch of
+k updates against n existing ascents costs O(k log n) comparisons
+instead of re-sorting and re-deduplicating all n + k on every update.
+
+compact_summary() encodes a summary column-wise per station for clients
+which do not need GeoJSON, as JSON or with the binaryutil delta codec,
+see "Compact summary" in README.md.
+"""
+
+import json
+import math
+import os
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+import binaryutil
+
+import config
+
+import mergeutil
+
+import util
+
+COMPACT_CODECS = ["json", "delta"]
+
+
+class StationAscents:
+    """
+    the summary ascents of one station, newest first.
+
+    insert() finds the position by bisection on syn_timestamp and keeps
+    a single ascent per (syn_timestamp, source) - the one inserted first.
+    With merge, it keeps a single ascent per syn_timestamp: the one with
+    the best mergeutil.rank(), the first of those on a tie.
+    prune() drops expired ascents off the old end, touching only those.
+    """
+
+    def __init__(self, ascents=(), merge=False):
+        self.ascents = []
+        self._keys = []  # -syn_timestamp, parallel to ascents
+        self.merge = merge
+        for a in sorted(ascents, key=itemgetter("syn_timestamp"), reverse=True):
+            self.insert(a)
+
+    def __len__(self):
+        return len(self.ascents)
+
+    def insert(self, asc):
+        """
+        insert asc, return False if an ascent with the same
+        syn_timestamp and source (with merge: a better or equal
+        one with the same syn_timestamp) is already present
+        """
+        k = -asc["syn_timestamp"]
+        lo = bisect_left(self._keys, k)
+        hi = bisect_right(self._keys, k, lo)
+        if self.merge and hi > lo:
+            best = max(mergeutil.rank(a["source"]) for a in self.ascents[lo:hi])
+            if mergeutil.rank(asc["source"]) <= best:
+                return False
+            # the duplicates asc supersedes
+            del self._keys[lo:hi]
+            del self.ascents[lo:hi]
+            hi = lo
+        for i in range(lo, hi):
+            if self.ascents[i]["source"] == asc["source"]:
+                return False
+        self._keys.insert(hi, k)
+        self.ascents.insert(hi, asc)
+        return True
+
+    def prune(self, cutoff_ts):
+        """
+        remove ascents with a syn_timestamp not after cutoff_ts,
+        return their number
+        """
+        n = 0
+        while self._keys and -self._keys[-1] <= cutoff_ts:
+            self._keys.pop()
+            self.ascents.pop()
+            n += 1
+        return n
+
+
+def group_by_station(updated_stations):
+    """
+    group a list of (station_id, ascent) by station_id,
+    preserving order within each station
+    """
+    groups = {}
+    for station, asc in updated_stations:
+        groups.setdefault(station, []).append(asc)
+    return groups
+
+
+def late_ascents(summary, since):
+    """
+    the stations of a summary FeatureCollection which have ascents
+    processed at or after since, as [(feature, [ascent, ...]), ...]
+    """
+    late = []
+    for f in summary.features:
+        ascents = [
+            a for a in f.properties["ascents"] if a.get("processed", 0) >= since
+        ]
+        if ascents:
+            late.append((f, ascents))
+    return late
+
+
+def merge_late(fc, late, cutoff_ts, merge=False):
+    """
+    catch-up merge of the late ascents of another summary into fc:
+    stations fc lacks are taken over whole, otherwise the ascents are
+    inserted as in update_geojson_summary. Return their number.
+    """
+    stations = {f.properties["station_id"]: f for f in fc.features}
+    n = 0
+    for feature, ascents in late:
+        station = feature.properties["station_id"]
+        if station not in stations:
+            fc.features.append(feature)
+            n += len(ascents)
+            continue
+        f = stations[station]
+        store = StationAscents(f.properties["ascents"], merge)
+        for a in ascents:
+            n += store.insert(a)
+        store.prune(cutoff_ts)
+        f.properties["ascents"] = store.ascents
+        if f.properties["id_type"] == "mobile":
+            # the late ascents are the newest ones
+            f.geometry = feature.geometry
+    return n
+
+
+def compact_path(summary, codec="json"):
+    """
+    name of the compact summary written next to the GeoJSON summary,
+    e.g. data/summary.geojson.br -> data/summary.compact.json.br,
+    or data/summary.compact.bin.br with the delta codec
+    """
+    d, fn = os.path.split(summary)
+    br = fn.endswith(".br")
+    if br:
+        fn = fn[:-3]
+    fn = fn.rsplit(".", 1)[0] if fn.endswith((".geojson", ".json")) else fn
+    return os.path.join(
+        d, fn + config.COMPACT_SUFFIX[codec] + (".br" if br else "")
+    )
+
+
+class CompactSummary:
+    """
+    build a compact summary one station feature at a time, so that
+    the features need not be held in memory (see gensummary.py)
+    """
+
+    def __init__(self, properties):
+        self.c = {
+            "fmt": properties["fmt"],
+            "encoding": config.COMPACT_ENCODING,
+            "generated": properties["generated"],
+            "max_age": properties["max_age"],
+            "sources": [],
+            "station_id": [],
+            "id_type": [],
+            "name": [],
+            "lon": [],
+            "lat": [],
+            "elevation": [],
+            "ascents": [],
+        }
+        self.src = []  # per station, the source names of its ascents
+
+    def add(self, f):
+        c = self.c
+        p = f.properties
+        lon, lat, elevation = f.geometry["coordinates"]
+        c["station_id"].append(p["station_id"])
+        c["id_type"].append(p["id_type"])
+        c["name"].append(p["name"])
+        c["lon"].append(lon)
+        c["lat"].append(lat)
+        c["elevation"].append(elevation)
+
+        ascents = sorted(p["ascents"], key=itemgetter("syn_timestamp"), reverse=True)
+        ts = [a["syn_timestamp"] for a in ascents]
+        cols = {"t": ts[:1] + [ts[i - 1] - ts[i] for i in range(1, len(ts))]}
+        keys = {k for a in ascents for k in a} - {"source", "syn_timestamp"}
+        for k in sorted(keys):
+            cols[k] = [a.get(k) for a in ascents]
+        c["ascents"].append(cols)
+        self.src.append([a["source"] for a in ascents])
+
+    def result(self):
+        c = self.c
+        sources = sorted({s for src in self.src for s in src})
+        index = {s: i for i, s in enumerate(sources)}
+        c["sources"] = sources
+        for cols, src in zip(c["ascents"], self.src):
+            cols["src"] = [index[s] for s in src]
+        return c
+
+
+def compact_summary(fc):
+    """
+    columnar encoding of a summary FeatureCollection
+
+    one entry per station in each of the station columns, and per station
+    one object of ascent columns: "t" holds the newest syn_timestamp
+    followed by the (positive) differences to the next older ascent,
+    "src" the index into "sources" of each ascent. Any other ascent
+    properties - "processed", and "lat", "lon" and "elevation" of mobile
+    stations - get a column of their own, with null where an ascent
+    lacks the property.
+    """
+    c = CompactSummary(fc.properties)
+    for f in fc.features:
+        c.add(f)
+    return c.result()
+
+
+def expand_compact(c):
+    """
+    inverse of compact_summary: a summary FeatureCollection
+    as plain dicts, ascents newest first
+    """
+    features = []
+    for i, cols in enumerate(c["ascents"]):
+        ts = []
+        for d in cols["t"]:
+            ts.append(ts[-1] - d if ts else d)
+        ascents = []
+        for j, t in enumerate(ts):
+            a = {"source": c["sources"][cols["src"][j]], "syn_timestamp": t}
+            for k, v in cols.items():
+                if k not in ("t", "src") and v[j] is not None:
+                    a[k] = v[j]
+            ascents.append(a)
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [c["lon"][i], c["lat"][i], c["elevation"][i]],
+                },
+                "properties": {
+                    "ascents": ascents,
+                    "station_id": c["station_id"][i],
+                    "id_type": c["id_type"][i],
+                    "name": c["name"][i],
+                },
+            }
+        )
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": {
+            "fmt": c["fmt"],
+            "generated": c["generated"],
+            "max_age": c["max_age"],
+        },
+    }
+
+
+def pack_compact(c):
+    """
+    encode a compact summary with the binaryutil delta codec: station and
+    ascent columns become varint columns, names and ids stay JSON
+    """
+    nan = float("nan")
+    ascents = c["ascents"]
+    props = {
+        k: c[k]
+        for k in ("fmt", "encoding", "generated", "max_age", "sources")
+        + ("station_id", "id_type", "name")
+    }
+    cols = [
+        ("lon", c["lon"], config.COMPACT_PRECISION["lon"]),
+        ("lat", c["lat"], config.COMPACT_PRECISION["lat"]),
+        ("elevation", c["elevation"], config.COMPACT_PRECISION["elevation"]),
+        ("n", [len(a["t"]) for a in ascents], 1),
+    ]
+    # back to absolute timestamps, the codec takes the differences
+    ts = []
+    for a in ascents:
+        t = None
+        for d in a["t"]:
+            t = d if t is None else t - d
+            ts.append(t)
+    cols.append(("t", ts, 1))
+    src = []
+    for a in ascents:
+        src.extend(a["src"])
+    cols.append(("src", src, 1))
+
+    # any other ascent column: numeric ones as varints, the rest as JSON.
+    # binaryutil column names are short, the property names are kept in
+    # "ascent_columns" and the varint columns are numbered a0, a1, ...
+    keys = sorted({k for a in ascents for k in a} - {"t", "src"})
+    props["ascent_json"] = {}
+    props["ascent_columns"] = []
+    for k in keys:
+        values = []
+        for a in ascents:
+            values.extend(a.get(k, [None] * len(a["t"])))
+        if all(v is None or isinstance(v, (int, float)) for v in values):
+            precision = config.COMPACT_PRECISION.get(k, 1e-6)
+            name = f"a{len(props['ascent_columns'])}"
+            props["ascent_columns"].append(k)
+            cols.append((name, [nan if v is None else v for v in values], precision))
+        else:
+            props["ascent_json"][k] = values
+    return binaryutil.pack(props, cols, codec="delta", nlevels=len(ascents))
+
+
+def unpack_compact(b):
+    """
+    inverse of pack_compact, returns the compact summary dict
+    """
+    props, cols = binaryutil.unpack(b)
+    c = {k: props[k] for k in ("fmt", "encoding", "generated", "max_age")}
+    for k in ("sources", "station_id", "id_type", "name"):
+        c[k] = props[k]
+    for k in ("lon", "lat", "elevation"):
+        c[k] = cols[k]
+
+    extra = {k: cols[f"a{i}"] for i, k in enumerate(props["ascent_columns"])}
+    for k, v in extra.items():
+        digits = max(0, round(-math.log10(config.COMPACT_PRECISION.get(k, 1e-6))))
+        extra[k] = [
+            None if math.isnan(x) else (int(x) if digits == 0 else x) for x in v
+        ]
+    extra.update(props["ascent_json"])
+
+    c["ascents"] = []
+    i = 0
+    for n in cols["n"]:
+        n = int(n)
+        ts = [int(t) for t in cols["t"][i : i + n]]
+        a = {
+            "t": ts[:1] + [ts[j - 1] - ts[j] for j in range(1, n)],
+            "src": [int(s) for s in cols["src"][i : i + n]],
+        }
+        for k, v in extra.items():
+            values = v[i : i + n]
+            if any(x is not None for x in values):
+                a[k] = values
+        c["ascents"].append(a)
+        i += n
+    return c
+
+
+def write_compact(c, summary, codec="json"):
+    """
+    write a compact summary next to the GeoJSON summary file
+    """
+    path = compact_path(summary, codec)
+    if codec == "delta":
+        b = pack_compact(c)
+        quality = config.BINARY_BROTLI_QUALITY
+    else:
+        b = json.dumps(c, separators=(",", ":")).encode(config.CHARSET)
+        quality = config.BROTLI_SUMMARY_QUALITY
+    util.write_file(b, path, useBrotli=path.endswith(".br"), quality=quality)
+    return path
+
+
+def write_compact_summary(fc, summary, codec="json"):
+    """
+    write the compact encoding of fc next to the GeoJSON summary file
+    """
+    return write_compact(compact_summary(fc), summary, codec)
@@ -0,0 +1,441 @@
+"""
+array-in, array-out kernels over thermodynamics.py
+
+every kernel takes NumPy columns (or anything np.asarray accepts) in
+the units of the detail files - temperatures in K, pressure in hPa -
+and returns float64 arrays of the same shape. Missing values may be
+NaN, +-inf or the MADIS -9999 sentinel; they come out as NaN, as does
+anything without a physical meaning, like a negative mixing ratio
+where the vapour pressure exceeds the pressure. No kernel raises or
+warns on such input.
+
+derived_profile() computes all of them for an ascent in one pass,
+sharing the vapour pressures between the quantities.
+
+convective_indices() lifts a surface parcel dry-adiabatically to its
+LCL, then along a moist adiabat read from a lookup table, for all
+levels at once. CAPE and CIN integrate the virtual temperature
+difference of parcel and environment over ln p.
+
+the table holds the temperature of the moist adiabats over wet-bulb
+potential temperature (their temperature at 1000 hPa) and -ln p, both
+on uniform grids, integrated from thermodynamics.GammaW for all
+adiabats at once. It is built on first use, in well under a second,
+and cached in config.MOIST_ADIABAT_CACHE. moist_adiabat_lookup()
+interpolates it bilinearly; moist_adiabat() integrates directly and
+serves as the reference.
+"""
+
+import logging
+import os
+from math import ceil, log
+
+import numpy as np
+
+import config
+
+from thermodynamics import (
+    Cp_da,
+    DewPoint,
+    GammaW,
+    MixR2VaporPress,
+    MixRatio,
+    Rs_da,
+    VaporPressure,
+    VirtualTemp,
+    WetBulb,
+    barometric_equation_inv,
+    degCtoK,
+    grav,
+)
+
+MISSING = -9999.0
+
+# step of the direct moist adiabat integration, in ln p
+_DLNP = 0.01
+
+# the moist adiabat table: rows _TW0 + k * _DTW (K), columns at
+# p = exp(-(_U0 + j * _DU)) hPa, from 1100 hPa up to 5 hPa
+_TW0, _DTW, _NTW = 233.15, 0.25, 341
+_U0, _DU, _NU = -log(1100.0), 0.01, 540
+_SUBSTEPS = 2
+_table = None
+
+_KAPPA = Rs_da / Cp_da
+
+
+def column(a):
+    """
+    a float64 copy of a with missing values and sentinels as NaN
+    """
+    a = np.array(a, dtype=np.float64)
+    a[~np.isfinite(a) | (a <= MISSING)] = np.nan
+    return a
+
+
+def _valid(a):
+    a[~np.isfinite(a)] = np.nan
+    return a
+
+
+def theta(temp, pressure):
+    """
+    potential temperature (K), reference pressure 1000 hPa
+    """
+    with np.errstate(all="ignore"):
+        return _valid(column(temp) * (1000.0 / column(pressure)) ** _KAPPA)
+
+
+def vapor_pressure(temp):
+    """
+    saturation vapour pressure over liquid water (hPa) at temp,
+    or the vapour pressure if temp is a dewpoint
+    """
+    with np.errstate(all="ignore"):
+        return _valid(VaporPressure(column(temp) - degCtoK) / 100.0)
+
+
+def mixing_ratio(dewpoint, pressure):
+    """
+    water vapour mixing ratio (kg/kg)
+    """
+    e = vapor_pressure(dewpoint)
+    with np.errstate(all="ignore"):
+        w = _valid(MixRatio(e, column(pressure)))
+    w[w < 0] = np.nan
+    return w
+
+
+def relative_humidity(temp, dewpoint):
+    """
+    relative humidity over liquid water (%)
+    """
+    with np.errstate(all="ignore"):
+        return _valid(100.0 * vapor_pressure(dewpoint) / vapor_pressure(temp))
+
+
+def theta_e(temp, dewpoint, pressure):
+    """
+    equivalent potential temperature (K) following Bolton (1980),
+    as thermodynamics.ThetaE_Bolton
+    """
+    t = column(temp)
+    p = column(pressure)
+    e = vapor_pressure(dewpoint)
+    with np.errstate(all="ignore"):
+        w = MixRatio(e, p)
+        w[w < 0] = np.nan
+        return _valid(_theta_e(t, p, e, w))
+
+
+def _theta_e(t, p, e, w):
+    td = DewPoint(e * 100.0) + degCtoK
+    tl = 56.0 + 1.0 / (1.0 / (td - 56.0) + np.log(t / td) / 800.0)
+    theta_l = t * (1000.0 / (p - e)) ** _KAPPA * (t / tl) ** (0.28 * w)
+    return theta_l * np.exp((3036.0 / tl - 0.78) * w * (1 + 0.448 * w))
+
+
+def wet_bulb(temp, dewpoint):
+    """
+    wet-bulb temperature (K) after Stull (2011), from temperature and RH
+    """
+    rh = relative_humidity(temp, dewpoint)
+    with np.errstate(all="ignore"):
+        return _valid(WetBulb(column(temp) - degCtoK, rh) + degCtoK)
+
+
+def barometric_heights(h0, t0, p0, pressure):
+    """
+    heights (m) of the pressure levels above a base level at h0 (m)
+    with temperature t0 (K) and pressure p0 (same unit as pressure),
+    standard lapse rate - barometric_equation_inv for a whole column
+    """
+    with np.errstate(all="ignore"):
+        return _valid(barometric_equation_inv(h0, t0, p0, column(pressure)))
+
+
+def hypsometric_heights(z0, temp, dewpoint, pressure):
+    """
+    geopotential heights (m) of the levels of an ascent, surface first,
+    from z0 at the first level: the hypsometric equation per layer with
+    the mean virtual temperature of its top and bottom, summed up.
+    A missing dewpoint counts as dry air, levels without a temperature
+    are interpolated in ln p.
+    """
+    t, td, p = column(temp), column(dewpoint), column(pressure)
+    z = np.full_like(p, np.nan)
+    ok = np.isfinite(t) & np.isfinite(p) & (p > 0)
+    if not np.any(ok):
+        return z
+    with np.errstate(all="ignore"):
+        e = np.nan_to_num(VaporPressure(td[ok] - degCtoK) / 100.0)
+        tv = VirtualTemp(t[ok], p[ok], e)
+        lnp = np.log(p[ok])
+        dz = Rs_da / grav * 0.5 * (tv[:-1] + tv[1:]) * (lnp[:-1] - lnp[1:])
+    zok = z0 + np.concatenate(([0.0], np.cumsum(dz)))
+    z[ok] = zok
+    gaps = ~ok & np.isfinite(p) & (p > 0)
+    if np.any(gaps) and len(zok) > 1:
+        # np.interp wants increasing x, -ln p grows with height
+        z[gaps] = np.interp(-np.log(p[gaps]), -lnp, zok)
+    return z
+
+
+def derived_profile(temp, dewpoint, pressure):
+    """
+    all derived quantities of an ascent in one pass, as a dict of
+    columns: theta, theta_e (K), mixing_ratio (kg/kg),
+    relative_humidity (%), wet_bulb (K)
+    """
+    t = column(temp)
+    p = column(pressure)
+    td = column(dewpoint)
+    with np.errstate(all="ignore"):
+        es = VaporPressure(t - degCtoK) / 100.0
+        e = VaporPressure(td - degCtoK) / 100.0
+        w = MixRatio(e, p)
+        w[w < 0] = np.nan
+        rh = 100.0 * e / es
+        result = {
+            "theta": t * (1000.0 / p) ** _KAPPA,
+            "theta_e": _theta_e(t, p, e, w),
+            "mixing_ratio": w,
+            "relative_humidity": rh,
+            "wet_bulb": WetBulb(t - degCtoK, rh) + degCtoK,
+        }
+    return {k: _valid(v) for k, v in result.items()}
+
+
+def moist_adiabat(t0, p0, pressure):
+    """
+    temperatures (K) at the pressure levels (hPa) of a saturated parcel
+    lifted from t0 (K) at p0 (hPa), integrating thermodynamics.GammaW
+    with Heun steps of _DLNP in ln p and interpolating to the levels.
+    Levels below p0 get t0.
+    """
+    p = column(pressure)
+    t = np.full_like(p, np.nan)
+    if not np.any(np.isfinite(p)):
+        return t
+    top = min(np.nanmin(p), p0)
+    n = max(1, ceil(log(p0 / top) / _DLNP))
+    lnp = np.linspace(log(p0), log(top), n + 1)
+    pa = np.exp(lnp) * 100.0
+    ts = [t0]
+    temp = t0
+    for i in range(n):
+        dp = pa[i + 1] - pa[i]
+        # GammaW is the lapse rate, the parcel cools as p drops
+        k1 = -GammaW(temp, pa[i])
+        k2 = -GammaW(temp + k1 * dp, pa[i + 1])
+        temp += 0.5 * (k1 + k2) * dp
+        ts.append(temp)
+    ok = np.isfinite(p)
+    t[ok] = np.interp(-np.log(p[ok]), -lnp, ts)
+    return t
+
+
+def _integrate(temp, p_from, p_to, steps):
+    """
+    Heun steps of GammaW from p_from to p_to (hPa), for an array
+    of parcel temperatures (K) at p_from
+    """
+    pa = np.exp(np.linspace(log(p_from), log(p_to), steps + 1)) * 100.0
+    for i in range(steps):
+        dp = pa[i + 1] - pa[i]
+        k1 = -GammaW(temp, pa[i])
+        k2 = -GammaW(temp + k1 * dp, pa[i + 1])
+        temp = temp + 0.5 * (k1 + k2) * dp
+    return temp
+
+
+def build_moist_adiabat_table():
+    """
+    the moist adiabat table, integrated from 1000 hPa up and down
+    """
+    p = np.exp(-(_U0 + _DU * np.arange(_NU)))
+    table = np.empty((_NTW, _NU))
+    k = int(np.argmax(p < 1000.0))
+    with np.errstate(all="ignore"):
+        for nodes in (range(k, _NU), range(k - 1, -1, -1)):
+            t = _TW0 + _DTW * np.arange(_NTW)
+            previous = 1000.0
+            for j in nodes:
+                t = _integrate(t, previous, p[j], _SUBSTEPS)
+                table[:, j] = t
+                previous = p[j]
+    return table
+
+
+def moist_adiabat_table():
+    """
+    the moist adiabat table, from the cache file if it is current
+    """
+    global _table
+    if _table is not None:
+        return _table
+    path = config.MOIST_ADIABAT_CACHE
+    try:
+        table = np.load(path)
+        if table.shape != (_NTW, _NU):
+            raise ValueError(f"shape {table.shape}")
+    except (OSError, ValueError) as e:
+        logging.debug(f"building moist adiabat table, {path}: {e}")
+        table = build_moist_adiabat_table()
+        try:
+            tmp = f"{path}.{os.getpid()}.npy"
+            np.save(tmp, table)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"cannot cache moist adiabat table in {path}: {e}")
+    _table = table
+    return _table
+
+
+def _nodes(p):
+    """
+    the table column left of each pressure and the fraction to the next
+    """
+    with np.errstate(all="ignore"):
+        f = (-np.log(p) - _U0) / _DU
+    f = np.where(np.isfinite(f), np.clip(f, 0, _NU - 1), 0)
+    j = np.minimum(f.astype(int), _NU - 2)
+    return j, f - j
+
+
+def moist_adiabat_lookup(t0, p0, pressure):
+    """
+    moist_adiabat() from the table: find the adiabat through t0 (K) at
+    p0 (hPa), then interpolate it to the pressure levels (hPa). Parcels
+    off the table are integrated directly.
+    """
+    table = moist_adiabat_table()
+    j, a = _nodes(np.array([p0]))
+    at_p0 = table[:, j[0]] * (1 - a[0]) + table[:, j[0] + 1] * a[0]
+    if not at_p0[0] <= t0 <= at_p0[-1]:
+        return moist_adiabat(t0, p0, pressure)
+    p = column(pressure)
+    r = np.interp(t0, at_p0, np.arange(_NTW))
+    k = min(int(r), _NTW - 2)
+    adiabat = table[k] * (k + 1 - r) + table[k + 1] * (r - k)
+    j, a = _nodes(p)
+    t = adiabat[j] * (1 - a) + adiabat[j + 1] * a
+    t[p > p0] = t0
+    t[~np.isfinite(p)] = np.nan
+    return t
+
+
+def _areas(b, x):
+    """
+    the positive and negative areas under the piecewise linear b(x)
+    per segment, split at zero crossings
+    """
+    b0, b1 = b[:-1], b[1:]
+    dx = np.diff(x)
+    with np.errstate(all="ignore"):
+        f = np.where(b0 != b1, b0 / (b0 - b1), 0.0)
+    same = (b0 >= 0) == (b1 >= 0)
+    whole = 0.5 * (b0 + b1) * dx
+    # on a crossing, b0 lives on a fraction f of the segment
+    part0 = 0.5 * b0 * f * dx
+    part1 = 0.5 * b1 * (1 - f) * dx
+    pos = np.where(
+        same, np.maximum(whole, 0), np.maximum(part0, 0) + np.maximum(part1, 0)
+    )
+    neg = np.where(
+        same, np.minimum(whole, 0), np.minimum(part0, 0) + np.minimum(part1, 0)
+    )
+    return pos, neg, f
+
+
+def convective_indices(temp, dewpoint, pressure, height=None):
+    """
+    surface-based parcel indices of an ascent as a dict:
+
+        lcl_pressure, lfc_pressure, el_pressure     hPa
+        cape, cin                                   J/kg
+        freezing_level                              m, needs height
+
+    keys are left out where the ascent does not have the level, or the
+    data; an ascent with no positive area above its LCL has cape 0 and
+    no lfc_pressure, el_pressure or cin.
+    """
+    t, td, p = column(temp), column(dewpoint), column(pressure)
+    z = column(height) if height is not None else np.full_like(p, np.nan)
+    ok = np.isfinite(t) & np.isfinite(p) & (p > 0)
+    order = np.argsort(-p[ok], kind="stable")
+    t, td, p, z = (a[ok][order] for a in (t, td, p, z))
+    if len(p):
+        # one level per pressure, the first one reported
+        keep = np.concatenate(([True], np.diff(p) < 0))
+        t, td, p, z = t[keep], td[keep], p[keep], z[keep]
+
+    result = {}
+    below = np.nonzero(t < degCtoK)[0]
+    if len(below) and np.isfinite(z[below[0]]):
+        i = below[0]
+        if i == 0:
+            result["freezing_level"] = z[0]
+        elif np.isfinite(z[i - 1]):
+            f = (t[i - 1] - degCtoK) / (t[i - 1] - t[i])
+            result["freezing_level"] = z[i - 1] + f * (z[i] - z[i - 1])
+
+    if len(p) < 2 or not np.isfinite(td[0]):
+        return result
+
+    with np.errstate(all="ignore"):
+        # the parcel: surface values, saturated at its LCL (Bolton)
+        t0, p0 = t[0], p[0]
+        td0 = min(td[0], t0)
+        e0 = VaporPressure(td0 - degCtoK) / 100.0
+        w0 = MixRatio(e0, p0)
+        tl = 56.0 + 1.0 / (1.0 / (td0 - 56.0) + np.log(t0 / td0) / 800.0)
+        p_lcl = p0 * (tl / t0) ** (1.0 / _KAPPA)
+        result["lcl_pressure"] = p_lcl
+
+        dry = p >= p_lcl
+        tp = np.where(
+            dry, t0 * (p / p0) ** _KAPPA, moist_adiabat_lookup(tl, p_lcl, p)
+        )
+        ep = np.where(
+            dry, MixR2VaporPress(w0, p), VaporPressure(tp - degCtoK) / 100.0
+        )
+        # a missing dewpoint counts as dry air
+        e = np.nan_to_num(VaporPressure(td - degCtoK) / 100.0)
+        b = VirtualTemp(tp, p, ep) - VirtualTemp(t, p, e)
+    if not np.all(np.isfinite(b)):
+        return result
+
+    x = -np.log(p)
+    pos, neg, f = _areas(b, x)
+
+    def crossing(j):
+        return float(np.exp(-(x[j] + f[j] * (x[j + 1] - x[j]))))
+
+    moist = np.nonzero(~dry)[0]
+    if not len(moist):
+        result["cape"] = 0.0
+        return result
+    first = moist[0]
+    up = np.nonzero((b[:-1] <= 0) & (b[1:] > 0) & ~dry[1:])[0]
+    if b[first] > 0:
+        # buoyant from the LCL on
+        lfc, cin_end, p_lfc = first, first, p_lcl
+    elif len(up):
+        lfc = up[0]
+        cin_end = lfc + 1
+        p_lfc = crossing(lfc)
+    else:
+        result["cape"] = 0.0
+        return result
+
+    down = np.nonzero((b[:-1] > 0) & (b[1:] <= 0))[0]
+    down = down[down >= lfc]
+    el = down[-1] if len(down) else len(b) - 2
+
+    result["lfc_pressure"] = p_lfc
+    if len(down):
+        result["el_pressure"] = crossing(el)
+    result["cape"] = Rs_da * float(np.sum(pos[lfc : el + 1]))
+    result["cin"] = Rs_da * float(np.sum(neg[:cin_end]))
+    return result
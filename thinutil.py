@@ -0,0 +1,106 @@
+"""
+shape-preserving thinning of ascent profiles
+
+decimate() is the Ramer-Douglas-Peucker algorithm, measured vertically:
+given the vertical coordinate of the levels and any number of columns,
+it keeps the levels needed for linear interpolation between them to
+reproduce every column within its tolerance. Inversions, the tropopause
+and wind shear survive, smooth stretches shrink to a few levels.
+
+used on ingest by bufrutil.convert_bufr_to_geojson (--thinning adaptive)
+and for the coarser previews of previewutil.
+"""
+
+import numpy as np
+
+import config
+
+
+def _filled(y, x):
+    """
+    y with missing values interpolated over x, zeros if there are none
+    """
+    ok = np.isfinite(y)
+    if ok.all():
+        return y
+    if not ok.any():
+        return np.zeros_like(y)
+    order = np.argsort(x[ok])
+    return np.interp(x, x[ok][order], y[ok][order])
+
+
+def decimate(x, ys, tolerances, keep=None):
+    """
+    indices of the levels to keep: x is the vertical coordinate, ascending
+    or descending, ys an (m, n) array of the columns, tolerances the
+    largest deviation allowed per column, keep a mask of levels to keep
+    in any case
+    """
+    n = len(x)
+    kept = np.zeros(n, dtype=bool) if keep is None else np.array(keep, dtype=bool)
+    if n <= 2:
+        kept[:] = True
+        return np.flatnonzero(kept)
+    kept[0] = kept[-1] = True
+    scaled = np.array([_filled(y, x) for y in ys]) / np.asarray(tolerances)[:, None]
+    levels = np.arange(n)
+
+    # all segments between kept levels are split at once, one pass per
+    # level of the recursion - the same levels as splitting one by one
+    while True:
+        left = np.maximum.accumulate(np.where(kept, levels, 0))
+        right = np.minimum.accumulate(np.where(kept, levels, n - 1)[::-1])[::-1]
+        dx = x[right] - x[left]
+        with np.errstate(all="ignore"):
+            t = np.where(dx != 0, (x - x[left]) / dx, 0.5)
+        line = scaled[:, left] + t * (scaled[:, right] - scaled[:, left])
+        d = np.max(np.abs(scaled - line), axis=0)
+        d[kept] = 0.0
+        # the worst level of each segment, if it is off by more than 1
+        starts = np.flatnonzero(kept)
+        worst = np.maximum.reduceat(d, starts)
+        segment = np.cumsum(kept) - 1
+        split = (d > 1.0) & (d == worst[segment])
+        if not split.any():
+            return starts
+        _, first = np.unique(segment[split], return_index=True)
+        kept[np.flatnonzero(split)[first]] = True
+
+
+def spaced(idx, height, min_step, keep=None):
+    """
+    the levels of idx at least min_step above the last one retained,
+    plus the first level and those set in keep
+    """
+    result = [idx[0]]
+    for i in idx[1:]:
+        if height[i] >= height[result[-1]] + min_step or (
+            keep is not None and keep[i]
+        ):
+            result.append(i)
+    return np.array(result, dtype=idx.dtype)
+
+
+def thin(pressure, height, cols, tolerances=None, keep=None, min_step=None):
+    """
+    indices of the levels of an ascent to keep: decimate() over -ln p,
+    or over height where the pressure is missing, of the columns in
+    cols {name: values} named by tolerances (config.THIN_TOLERANCE).
+    With min_step, at most one level per min_step metres of height is
+    kept, so sensor noise above the tolerances cannot keep every level.
+    """
+    tolerances = tolerances or config.THIN_TOLERANCE
+    with np.errstate(all="ignore"):
+        x = -np.log(np.asarray(pressure, dtype=np.float64))
+    if not np.isfinite(x).all():
+        x = np.asarray(height, dtype=np.float64)
+    names = list(tolerances)
+    idx = decimate(
+        x,
+        [np.asarray(cols[k], dtype=np.float64) for k in names],
+        [tolerances[k] for k in names],
+        keep,
+    )
+    if min_step:
+        idx = spaced(idx, np.asarray(height, dtype=np.float64), min_step, keep)
+    return idx
@@ -10,7 +10,7 @@ import brotli
 
 import config
 
-import geojson
+import metrics
 
 
 def now():
@@ -29,14 +29,17 @@ def read_file(name, useBrotli=False):
         sl = len(s)
         if useBrotli:
             s = brotli.decompress(s)
-            ratio = (sl / len(s)) * 100.0
-            logging.debug(f"w {name}: brotli {sl} -> {len(s)}, {ratio:.1f}%")
+            logging.debug(
+                "r %s: brotli %d -> %d, %.1f%%", name, sl, len(s), sl / len(s) * 100.0
+            )
         return s
 
 
 def read_json_file(name, useBrotli=False, asGeojson=False):
     s = read_file(name, useBrotli=useBrotli).decode()
     if asGeojson:
+        import geojson
+
         return geojson.loads(s)
     else:
         return json.loads(s)
@@ -44,28 +47,87 @@ def read_json_file(name, useBrotli=False, asGeojson=False):
 
 def write_json_file(d, name, useBrotli=False, asGeojson=False):
     if asGeojson:
+        import geojson
+
         b = geojson.dumps(d, indent=config.INDENT).encode(config.CHARSET)
     else:
         b = json.dumps(d, indent=config.INDENT).encode(config.CHARSET)
     write_file(b, name, useBrotli=useBrotli)
 
 
-def write_file(s, name, useBrotli=False):
+def write_file(s, name, useBrotli=False, quality=config.BROTLI_SUMMARY_QUALITY):
     fd, path = tempfile.mkstemp(dir=config.tmpdir)
     if useBrotli:
         sl = len(s)
         start = time.time()
-        s = brotli.compress(s, quality=config.BROTLI_SUMMARY_QUALITY)
+        with metrics.timer("brotli_compress"):
+            s = brotli.compress(s, quality=quality)
         end = time.time()
         dt = end - start
         dl = len(s)
-        ratio = (1.0 - dl / sl) * 100.0
+        metrics.count("bytes_uncompressed_total", sl)
+        metrics.observe("compression_ratio", dl / sl)
         logging.debug(
-            f"w {name}: brotli {sl} -> {dl},"
-            f" compression={ratio:.1f}% in {dt:.3f}s"
+            "w %s: brotli %d -> %d, compression=%.1f%% in %.3fs",
+            name,
+            sl,
+            dl,
+            (1.0 - dl / sl) * 100.0,
+            dt,
         )
+    metrics.count("bytes_written_total", len(s))
     os.write(fd, s)
     os.fsync(fd)
     os.close(fd)
     os.rename(path, name)
     os.chmod(name, 0o644)
+
+
+def write_feature_collection(features, properties, name, useBrotli=False):
+    """
+    write a GeoJSON FeatureCollection from an iterable of features,
+    serializing and compressing one feature at a time instead of
+    building the whole collection and its text in memory
+    """
+    import geojson
+
+    fd, path = tempfile.mkstemp(dir=config.tmpdir)
+    compressor = None
+    if useBrotli:
+        compressor = brotli.Compressor(quality=config.BROTLI_SUMMARY_QUALITY)
+    sl = dl = 0
+    start = time.time()
+    with os.fdopen(fd, "wb") as f:
+
+        def emit(s):
+            nonlocal sl, dl
+            b = s.encode(config.CHARSET)
+            sl += len(b)
+            if compressor:
+                b = compressor.process(b)
+            dl += len(b)
+            f.write(b)
+
+        emit('{"type": "FeatureCollection", "features": [')
+        sep = "\n"
+        for feature in features:
+            emit(sep + geojson.dumps(feature, indent=config.INDENT))
+            sep = ",\n"
+        emit('\n], "properties": ' + json.dumps(properties, indent=config.INDENT))
+        emit("}\n")
+        if compressor:
+            b = compressor.finish()
+            dl += len(b)
+            f.write(b)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if useBrotli:
+        metrics.count("bytes_uncompressed_total", sl)
+        metrics.observe("compression_ratio", dl / sl)
+    metrics.count("bytes_written_total", dl)
+    logging.debug(
+        "w %s: streamed %d -> %d bytes in %.3fs", name, sl, dl, time.time() - start
+    )
+    os.rename(path, name)
+    os.chmod(name, 0o644)